@@ -1,49 +1,236 @@
 from db import db
-from flask import Flask, request
+from flask import Blueprint, Flask, request
 import json
-from db import Restaurant, User, Food, UserFoodReview
+import math
+from db import Restaurant, User, Food, UserFoodReview, ScrapeSource, favorites_table
+from db import PROFILE_SECTIONS, backfill_ratings, create_search_index, migrate
+from fastjson import (
+    food_dict,
+    food_rows,
+    iter_restaurant_dicts,
+    json_response,
+    restaurant_dicts,
+    restaurant_rows,
+)
+from dbconfig import configure_engine, engine_options, replica_binds, replica_reads
+from sqlalchemy import text
+from catalog import category_catalog
+from matchcache import RESTAURANT_SCOPE, match_cache, menu_scope
+from responsecache import RESTAURANTS_SCOPE, response_cache, restaurant_scope
+from reviews import (
+    FEED_SORTS,
+    feed_query,
+    iter_review_feed,
+    parse_feed_cursor,
+    review_feed,
+)
+from pagination import (
+    MAX_LIMIT,
+    get_page_args,
+    wants_stream,
+    paginate,
+    stream_collection,
+    stream_json,
+    cursor_headers,
+)
+from search import SEARCH_LIMIT, SearchTooBroad, search_foods, search_terms
 import urllib.parse
 import difflib
 
-## for scraper
-import requests
-from bs4 import BeautifulSoup
-import re
 import argparse
-from convert import get_closest_match
-from receiptparser import parse_receipt
+import click
+import logging
+import os
+from convert import (
+    MATCH_THRESHOLD,
+    find_closest_match,
+    get_closest_matches,
+    get_matcher,
+)
+from jobs import ReceiptJobQueue
+from receiptcache import ReceiptCache
+from scraper import Scraper, is_allowed_url
 
-app = Flask(__name__)
 db_filename = "munch.db"
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % db_filename
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ECHO"] = False
+DEFAULT_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": os.getenv("DATABASE_URL", "sqlite:///%s" % db_filename),
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    "SQLALCHEMY_ECHO": False,
+}
 
-db.init_app(app)
-with app.app_context():
+# Every route and CLI command is registered on this blueprint by create_app()
+api = Blueprint("munch", __name__, cli_group=None)
+
+
+def parse_receipt(image_bytes, metrics=None):
+    """
+    Loads the receipt parser, and with it PIL and pydantic, on the first upload
+    """
+    from receiptparser import parse_receipt
+
+    return parse_receipt(image_bytes, metrics)
+
+
+receipt_jobs = ReceiptJobQueue(parse_receipt, cache=ReceiptCache())
+scraper = Scraper()
+
+
+def create_app(config=None):
+    """
+    Builds the app from DEFAULT_CONFIG updated with config. DB_POOL_SIZE,
+    DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and DATABASE_REPLICA_URLS in config
+    override the environment. Nothing touches the database here: create the
+    schema with `flask --app app init-db`. The receipt and scraper pools start
+    with start_background_workers(), or on their first job otherwise.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS",
+        engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config),
+    )
+    app.config.setdefault("SQLALCHEMY_BINDS", replica_binds(app.config))
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            configure_engine(engine)
+    app.register_blueprint(api)
+    return app
+
+
+def start_background_workers(app):
+    receipt_jobs.init_app(app)
+    scraper.init_app(app)
+
+
+def stop_background_workers():
+    """
+    Lets running receipt and scrape jobs finish and drops queued ones, which
+    are picked up again on the next start
+    """
+    receipt_jobs.shutdown()
+    scraper.shutdown()
+
+
+@api.cli.command("init-db")
+def init_db_command():
+    """
+    Creates any missing tables, and the food search index
+    """
     db.create_all()
+    with db.engine.begin() as connection:
+        create_search_index(connection)
+    click.echo("Database ready.")
+
+
+@api.cli.command("migrate")
+def migrate_command():
+    """
+    Applies new columns, keys and indexes to an existing database
+    """
+    migrate()
+
+
+@api.cli.command("backfill-ratings")
+def backfill_ratings_command():
+    """
+    Recomputes every food's rating aggregates from its reviews
+    """
+    backfill_ratings()
+
+
+@api.cli.command("scrape")
+@click.argument("urls", nargs=-1)
+def scrape_command(urls):
+    """
+    Refreshes the given menu pages, or every known page
+    """
+    logging.basicConfig(level=logging.INFO)
+    click.echo(scraper.run(list(urls) or None))
+
 
 # User endpoints
 
 
-@app.route("/")
+def get_profile_sections():
+    """
+    Reads the profile sections requested through ?include= (or its alias
+    ?fields=). Returns None if an unknown section is requested.
+    """
+    include = request.args.get("include", request.args.get("fields"))
+    if include is None:
+        return PROFILE_SECTIONS
+    sections = tuple(s.strip() for s in include.split(",") if s.strip())
+    if any(section not in PROFILE_SECTIONS for section in sections):
+        return None
+    return sections
+
+
+def load_user_profile(user_id, sections):
+    """
+    Loads a user with every requested profile section batched
+    """
+    return (
+        User.query.options(*User.profile_options(sections))
+        .filter_by(id=user_id)
+        .first()
+    )
+
+
+@api.route("/")
 def welcome():
     return json.dumps("Welcome to munch!")
 
 
-@app.route("/api/users/")
+@api.route("/api/health/")
+def health():
+    """
+    Liveness probe: the process is up and serving requests
+    """
+    return json.dumps({"status": "ok"}), 200
+
+
+@api.route("/api/ready/")
+def ready():
+    """
+    Readiness probe: the database answers queries
+    """
+    try:
+        db.session.execute(text("SELECT 1"))
+    except Exception as e:
+        return json.dumps({"error": "Database unavailable: %s" % e}), 503
+    return json.dumps({"status": "ready"}), 200
+
+
+@api.route("/api/users/")
+@replica_reads
 def get_all_users():
     """
-    Gets all users in the DB
+    Gets all users in the DB, paginated with ?limit= and ?after=
     """
-    users = []
-    for user in User.query.all():
-        users.append(user.serialize())
-    return json.dumps({"users": users}), 200
+    sections = get_profile_sections()
+    if sections is None:
+        return json.dumps({"error": "Invalid profile section"}), 400
+    query = User.query.options(*User.profile_options(sections))
+    if wants_stream():
+        return stream_collection(
+            "users", query, User.id, lambda user: user.serialize(sections)
+        )
+    try:
+        limit, after = get_page_args()
+    except ValueError:
+        return json.dumps({"error": "Invalid pagination parameters"}), 400
+    page, next_cursor = paginate(query, User.id, limit, after)
+    users = [user.serialize(sections) for user in page]
+    return json_response(
+        {"users": users, "next_cursor": next_cursor},
+        headers=cursor_headers(next_cursor),
+    )
 
 
-@app.route("/api/users/", methods=["POST"])
+@api.route("/api/users/", methods=["POST"])
 def create_user():
     """
     Creates a new user in the DB
@@ -56,24 +243,32 @@ def create_user():
     profile_image = body.get("profile_image")
     # if username is None or password is None or email is None or phone is None:
     #     return json.dumps({"error": "Invalid input"}), 400
+    sections = get_profile_sections()
+    if sections is None:
+        return json.dumps({"error": "Invalid profile section"}), 400
     new_user = User(**body)
     db.session.add(new_user)
     db.session.commit()
-    return json.dumps(new_user.serialize()), 201
+    new_user = load_user_profile(new_user.id, sections)
+    return json.dumps(new_user.serialize(sections)), 201
 
 
-@app.route("/api/users/<int:user_id>/")
+@api.route("/api/users/<int:user_id>/")
+@replica_reads
 def get_user_by_id(user_id):
     """
     Gets a user by id from DB
     """
-    user = User.query.filter_by(id=user_id).first()
+    sections = get_profile_sections()
+    if sections is None:
+        return json.dumps({"error": "Invalid profile section"}), 400
+    user = load_user_profile(user_id, sections)
     if user is None:
         return json.dumps({"error": "User not found!"}), 404
-    return json.dumps(user.serialize()), 200
+    return json.dumps(user.serialize(sections)), 200
 
 
-@app.route("/api/users/<int:user_id>/", methods=["DELETE"])
+@api.route("/api/users/<int:user_id>/", methods=["DELETE"])
 def delete_user_by_id(user_id):
     """
     Deletes a user by its id from DB
@@ -89,18 +284,31 @@ def delete_user_by_id(user_id):
 # Restaurant endpoints
 
 
-@app.route("/api/restaurants/")
+# The cached restaurant views read the primary, so a lagging replica can't
+# refill the cache with data from before an invalidation
+@api.route("/api/restaurants/")
+@response_cache.cached(RESTAURANTS_SCOPE)
 def get_all_restaurants():
     """
-    Gets all restaurants in the DB
+    Gets all restaurants in the DB, paginated with ?limit= and ?after=
     """
-    restaurants = []
-    for restaurant in Restaurant.query.all():
-        restaurants.append(restaurant.serialize())
-    return json.dumps({"restaurants": restaurants}), 200
+    query = restaurant_rows()
+    if wants_stream():
+        return stream_json(
+            "restaurants", iter_restaurant_dicts(query, Restaurant.id), dict
+        )
+    try:
+        limit, after = get_page_args()
+    except ValueError:
+        return json.dumps({"error": "Invalid pagination parameters"}), 400
+    page, next_cursor = paginate(query, Restaurant.id, limit, after)
+    return json_response(
+        {"restaurants": restaurant_dicts(page), "next_cursor": next_cursor},
+        headers=cursor_headers(next_cursor),
+    )
 
 
-@app.route("/api/restaurants/", methods=["POST"])
+@api.route("/api/restaurants/", methods=["POST"])
 def create_restaurant():
     """
     Creates a new restaurant in the DB
@@ -114,10 +322,13 @@ def create_restaurant():
     new_restaurant = Restaurant(**body)
     db.session.add(new_restaurant)
     db.session.commit()
+    match_cache.invalidate(RESTAURANT_SCOPE)
+    response_cache.invalidate(RESTAURANTS_SCOPE)
     return json.dumps(new_restaurant.serialize()), 201
 
 
-@app.route("/api/restaurants/<int:restaurant_id>/")
+@api.route("/api/restaurants/<int:restaurant_id>/")
+@response_cache.cached(restaurant_scope)
 def get_restaurant_by_id(restaurant_id):
     """
     Gets a restaurant by its id from DB
@@ -128,7 +339,7 @@ def get_restaurant_by_id(restaurant_id):
     return json.dumps(restaurant.serialize()), 200
 
 
-@app.route("/api/restaurants/<int:restaurant_id>/", methods=["DELETE"])
+@api.route("/api/restaurants/<int:restaurant_id>/", methods=["DELETE"])
 def delete_restaurant_by_id(restaurant_id):
     """
     Deletes a restaurant by its id from DB
@@ -136,12 +347,18 @@ def delete_restaurant_by_id(restaurant_id):
     restaurant = Restaurant.query.filter_by(id=restaurant_id).first()
     if restaurant is None:
         return json.dumps({"error": "Restaurant not found!"}), 404
+    serialized = restaurant.serialize()
     db.session.delete(restaurant)
     db.session.commit()
-    return json.dumps(restaurant.serialize()), 200
+    category_catalog.invalidate()
+    match_cache.invalidate(RESTAURANT_SCOPE)
+    match_cache.invalidate(menu_scope(restaurant_id))
+    response_cache.invalidate_restaurant(restaurant_id)
+    return json.dumps(serialized), 200
 
 
-@app.route("/api/restaurants/<int:restaurant_id>/menu/")
+@api.route("/api/restaurants/<int:restaurant_id>/menu/")
+@response_cache.cached(restaurant_scope)
 def get_menu(restaurant_id):
     """
     Gets all food items on a restaurant's menu
@@ -152,10 +369,11 @@ def get_menu(restaurant_id):
         return json.dumps({"error": "Restaurant not found!"}), 404
     for food in restaurant.menu:
         menu.append(food.simple_serialize())
-    return json.dumps(menu), 200
+    return json_response(menu)
 
 
-@app.route("/api/restaurants/<string:restaurant_name>/menu/")
+@api.route("/api/restaurants/<string:restaurant_name>/menu/")
+@replica_reads
 def get_restaurant_id_by_name(restaurant_name):
     """
     Gets the id of the restaurant based on the name
@@ -169,18 +387,27 @@ def get_restaurant_id_by_name(restaurant_name):
 # Food endpoints
 
 
-@app.route("/api/food/")
+@api.route("/api/food/")
+@replica_reads
 def get_all_food():
     """
-    Gets all food items in the DB
+    Gets all food items in the DB, paginated with ?limit= and ?after=
     """
-    foods = []
-    for food in Food.query.all():
-        foods.append(food.serialize())
-    return json.dumps({"food_items": foods}), 200
+    query = food_rows()
+    if wants_stream():
+        return stream_collection("food_items", query, Food.id, food_dict)
+    try:
+        limit, after = get_page_args()
+    except ValueError:
+        return json.dumps({"error": "Invalid pagination parameters"}), 400
+    page, next_cursor = paginate(query, Food.id, limit, after)
+    return json_response(
+        {"food_items": [food_dict(row) for row in page], "next_cursor": next_cursor},
+        headers=cursor_headers(next_cursor),
+    )
 
 
-@app.route("/api/restaurants/<int:restaurant_id>/food/", methods=["POST"])
+@api.route("/api/restaurants/<int:restaurant_id>/food/", methods=["POST"])
 def create_food(restaurant_id):
     """
     Creates a new food and adds it to a restaurant
@@ -196,6 +423,8 @@ def create_food(restaurant_id):
     initial_rating = body.get("initial_rating")
     if name is None or price is None or category is None:
         return json.dumps({"error": "Invalid input"}), 400
+    if Food.query.filter_by(restaurant_id=restaurant_id, name=name).first():
+        return json.dumps({"error": "Food already on this menu!"}), 409
     new_food = Food(
         name=name,
         price=price,
@@ -206,10 +435,14 @@ def create_food(restaurant_id):
     )
     db.session.add(new_food)
     db.session.commit()
+    category_catalog.invalidate()
+    match_cache.invalidate(menu_scope(restaurant_id))
+    response_cache.invalidate_restaurant(restaurant_id)
     return json.dumps(new_food.serialize()), 201
 
 
-@app.route("/api/food/<int:food_id>/")
+@api.route("/api/food/<int:food_id>/")
+@replica_reads
 def get_food_by_id(food_id):
     """
     Gets a food item by id from DB
@@ -220,17 +453,23 @@ def get_food_by_id(food_id):
     return json.dumps(food.serialize()), 200
 
 
-@app.route("/api/food/<int:food_id>/", methods=["DELETE"])
+@api.route("/api/food/<int:food_id>/", methods=["DELETE"])
 def delete_food_by_id(food_id):
     food = Food.query.filter_by(id=food_id).first()
     if food is None:
         return json.dumps({"error": "Food not found!"}), 404
+    serialized = food.serialize()
+    restaurant_id = food.restaurant_id
     db.session.delete(food)
     db.session.commit()
-    return json.dumps(food.serialize()), 200
+    category_catalog.invalidate()
+    match_cache.invalidate(menu_scope(restaurant_id))
+    response_cache.invalidate_restaurant(restaurant_id)
+    return json.dumps(serialized), 200
 
 
-@app.route("/api/food/<int:food_id>/name")
+@api.route("/api/food/<int:food_id>/name")
+@replica_reads
 def get_food_name_by_id(food_id):
     """
     Gets a food item's name by id from DB
@@ -241,11 +480,14 @@ def get_food_name_by_id(food_id):
     return json.dumps({"name": food.name}), 200
 
 
-@app.route("/api/users/<int:user_id>/food/", methods=["POST"])
+@api.route("/api/users/<int:user_id>/food/", methods=["POST"])
 def add_food_to_user(user_id):
     """
     Assigns a food to a user, updates ratings and adds the user's review
     """
+    sections = get_profile_sections()
+    if sections is None:
+        return json.dumps({"error": "Invalid profile section"}), 400
     user = User.query.filter_by(id=user_id).first()
     if user is None:
         return json.dumps({"error": "User not found!"}), 404
@@ -258,16 +500,17 @@ def add_food_to_user(user_id):
     food = Food.query.filter_by(id=food_id).first()
     if food is None:
         return json.dumps({"error": "Food not found!"}), 404
-    review_count = UserFoodReview.query.filter_by(food_id=food_id).count()
-    new_avg_rating = (food.avg_rating * review_count + rating) / (review_count + 1)
-    food.update_avg_rating(new_avg_rating)
-    user.foods.append(food)
+    if food not in user.foods:
+        user.foods.append(food)
     db.session.add(review)
+    Food.add_rating(food_id, rating)
     db.session.commit()
-    return json.dumps(user.serialize()), 201
+    response_cache.invalidate_restaurant(food.restaurant_id)
+    user = load_user_profile(user_id, sections)
+    return json.dumps(user.serialize(sections)), 201
 
 
-@app.route("/api/food/reviews/", methods=["POST"])
+@api.route("/api/food/reviews/", methods=["POST"])
 def create_review():
     data = request.get_json()
 
@@ -278,95 +521,107 @@ def create_review():
         review=data["review"],
     )
     db.session.add(review)
+    Food.add_rating(data["food_id"], data["rating"])
     db.session.commit()
+    food = db.session.get(Food, data["food_id"])
+    if food is not None:
+        response_cache.invalidate_restaurant(food.restaurant_id)
 
     return json.dumps({"message": "Review created successfully"}), 201
 
 
-@app.route("/api/food/<int:food_id>/reviews/")
+def get_review_feed(query):
+    """
+    Responds with a review feed ordered by ?sort= (recent or rating) and
+    paginated with ?limit= and ?after=, or streamed with ?stream=1
+    """
+    sort = request.args.get("sort", "recent")
+    if sort not in FEED_SORTS:
+        return json.dumps({"error": "Invalid sort"}), 400
+    if wants_stream():
+        return stream_json(
+            None, iter_review_feed(query, sort), UserFoodReview.serialize
+        )
+    try:
+        limit, after = get_page_args(parse_feed_cursor(sort))
+    except ValueError:
+        return json.dumps({"error": "Invalid pagination parameters"}), 400
+    reviews, next_cursor = review_feed(query, sort, limit, after)
+    all_reviews = [item.serialize() for item in reviews]
+    return json_response(all_reviews, headers=cursor_headers(next_cursor))
+
+
+@api.route("/api/food/<int:food_id>/reviews/")
+@replica_reads
 def get_reviews(food_id):
     """
     Gets all reviews associated with a food item
     """
-    all_reviews = []
-    reviews = UserFoodReview.query.filter_by(food_id=food_id).all()
-    if reviews is None:
-        return json.dumps({"error": "Reviews not found!"}), 404
-
-    for item in reviews:
-        user = item.user
-        all_reviews.append(
-            {
-                "id": user.id,
-                "username": user.username,
-                "review": item.review,
-                "rating": item.rating,
-                "profile_image": user.profile_image,
-            }
-        )
-    return json.dumps(all_reviews), 200
+    return get_review_feed(feed_query(food_id=food_id))
 
 
-@app.route("/api/food/categories/")
+@api.route("/api/food/categories/")
 def get_all_categories():
     """
-    Gets all food categories
+    Gets all food categories and the number of foods in each
     """
-    foods = Food.query.all()
-    categories = []
-    for food in foods:
-        if food.category not in categories:
-            categories.append(food.category)
-    return json.dumps({"categories": categories}), 200
+    counts = category_catalog.get()
+    return json.dumps({"categories": list(counts), "counts": counts}), 200
 
 
-@app.route("/api/<string:category>/foods/")
+@api.route("/api/<string:category>/foods/")
+@replica_reads
 def get_all_food_by_category(category):
     """
     Gets all food items in a given category
     """
-    foods = Food.query.filter_by(category=category).all()
+    foods = food_rows().filter(Food.category == category).order_by(Food.id).all()
     if not foods:
         return json.dumps({"error": "No food items found in this category"}), 404
 
-    food_list = [food.serialize() for food in foods]
-    return json.dumps({"food_items": food_list}), 200
+    return json_response({"food_items": [food_dict(row) for row in foods]})
+
+
+@api.route("/api/search")
+@replica_reads
+def search():
+    """
+    Finds foods whose name, category, restaurant name or address match every
+    word of ?q= as a prefix, best match first
+    """
+    query = request.args.get("q", "")
+    if not search_terms(query):
+        return json.dumps({"error": "Search query required!"}), 400
+    try:
+        limit = int(request.args.get("limit", SEARCH_LIMIT))
+    except ValueError:
+        return json.dumps({"error": "Invalid limit"}), 400
+    if limit < 1 or limit > MAX_LIMIT:
+        return json.dumps({"error": "Invalid limit"}), 400
+    try:
+        foods = search_foods(query, limit)
+    except SearchTooBroad:
+        return json.dumps({"error": "Search too broad, add more words!"}), 400
+    return json_response({"food_items": [food_dict(row) for row in foods]})
 
 
-@app.route("/api/food/<string:category>/reviews/")
+@api.route("/api/food/<string:category>/reviews/")
+@replica_reads
 def get_reviews_by_category(category):
     """
-    Gets all reviews associated with a food item
+    Gets all reviews of food items in a given category
     """
-    all_reviews = []
-    foods = Food.query.filter_by(category=category).all()
-    if foods is None:
-        return json.dumps({"error": "Food not found!"}), 404
+    return get_review_feed(feed_query(category=category))
 
-    for food in foods:
-        reviews = UserFoodReview.query.filter_by(food_id=food.id).all()
-        if reviews is None:
-            return json.dumps({"error": "Reviews not found!"}), 404
-
-        for item in reviews:
-            user = item.user
-            all_reviews.append(
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "review": item.review,
-                    "rating": item.rating,
-                    "profile_image": user.profile_image,
-                }
-            )
-    return json.dumps(all_reviews), 200
-
-
-@app.route("/api/users/<int:user_id>/favorites/", methods=["POST"])
+
+@api.route("/api/users/<int:user_id>/favorites/", methods=["POST"])
 def add_favorite(user_id):
     """
     Assigns a food to a user's favorite foods
     """
+    sections = get_profile_sections()
+    if sections is None:
+        return json.dumps({"error": "Invalid profile section"}), 400
     user = User.query.filter_by(id=user_id).first()
     if user is None:
         return json.dumps({"error": "User not found!"}), 404
@@ -375,12 +630,15 @@ def add_favorite(user_id):
     food = Food.query.filter_by(id=food_id).first()
     if food is None:
         return json.dumps({"error": "Food not found!"}), 404
-    user.favorite_foods.append(food)
-    db.session.commit()
-    return json.dumps(user.serialize()), 200
+    if food not in user.favorite_foods:
+        user.favorite_foods.append(food)
+        db.session.commit()
+    user = load_user_profile(user_id, sections)
+    return json.dumps(user.serialize(sections)), 200
 
 
-@app.route("/api/users/<int:user_id>/favorites/")
+@api.route("/api/users/<int:user_id>/favorites/")
+@replica_reads
 def get_favorites(user_id):
     """
     Gets all favorited items of a user
@@ -389,11 +647,16 @@ def get_favorites(user_id):
     if user is None:
         return json.dumps({"error": "User not found!"}), 404
 
-    favorited = [food.serialize() for food in user.favorite_foods]
-    return json.dumps({"favorited_foods": favorited}), 200
+    favorites = (
+        food_rows()
+        .join(favorites_table, favorites_table.c.food_id == Food.id)
+        .filter(favorites_table.c.user_id == user_id)
+        .all()
+    )
+    return json_response({"favorited_foods": [food_dict(row) for row in favorites]})
 
 
-@app.route("/api/payment/<int:user_id>/", methods=["POST"])
+@api.route("/api/payment/<int:user_id>/", methods=["POST"])
 def send_pay_request(user_id):
     """
     Gets all favorited items of a user
@@ -415,57 +678,127 @@ def send_pay_request(user_id):
 
 
 # New endpoint to run the scraper
-@app.route("/api/scrape/", methods=["POST"])
+@api.route("/api/scrape/", methods=["POST"])
 def scrape_restaurant():
     """
-    Runs the scraper to populate the database with Pho Time restaurant data
+    Queues a background refresh of the given menu pages, or of every known page
+    if none are given. Poll GET /api/scrape/ for the outcome.
     """
-    success = run_scraper()
-    if success:
-        return (
-            json.dumps({"success": "Restaurant data scraped and saved to database"}),
-            200,
-        )
-    else:
-        return json.dumps({"error": "Failed to scrape restaurant data"}), 500
+    body = json.loads(request.data or "{}")
+    urls = body.get("urls")
+    if urls is not None and (
+        not isinstance(urls, list) or not all(isinstance(u, str) for u in urls)
+    ):
+        return json.dumps({"error": "urls must be a list of strings!"}), 400
+    if urls is not None and not all(is_allowed_url(u) for u in urls):
+        return json.dumps({"error": "urls must be pages on an allowed host!"}), 400
+    scraper.submit(urls)
+    return json.dumps({"status": "queued", "urls": urls}), 202
+
+
+@api.route("/api/scrape/")
+def get_scrape_sources():
+    """
+    Returns the outcome of the last refresh of every menu page
+    """
+    sources = ScrapeSource.query.order_by(ScrapeSource.url)
+    return json.dumps({"sources": [s.serialize() for s in sources]}), 200
 
 
 # New endpoint to go from receipt item to db item
-@app.route("/api/convert/")
+@api.route("/api/convert/")
 def get_closest_item():
     body = json.loads(request.data)
     restaurant = body.get("restaurant")
     item = body.get("item")
+    if not isinstance(restaurant, str) or not isinstance(item, str):
+        return json.dumps({"error": "Invalid input"}), 400
 
     dbrestaurant, dbitem = convert(restaurant, item)
 
     return json.dumps({"restaurant": dbrestaurant, "item": dbitem})
 
 
-@app.route("/api/receipts/", methods=["POST"])
+@api.route("/api/convert/batch", methods=["POST"])
+def get_closest_items():
+    """
+    Matches every line of a receipt to the restaurant's menu in one request
+    """
+    body = json.loads(request.data)
+    restaurant = body.get("restaurant")
+    items = body.get("items")
+    if (
+        not isinstance(restaurant, str)
+        or not isinstance(items, list)
+        or not all(isinstance(item, str) for item in items)
+    ):
+        return json.dumps({"error": "Invalid input"}), 400
+
+    dbrestaurant, dbitems = convert_batch(restaurant, items)
+    if dbrestaurant is None:
+        return json.dumps({"error": "Restaurant not found!"}), 404
+
+    return json.dumps({"restaurant": dbrestaurant, "items": dbitems}), 200
+
+
+@api.route("/api/convert/stats/")
+def get_match_cache_stats():
+    """
+    Gets the hit and miss counters of the receipt match cache
+    """
+    return json.dumps(match_cache.stats()), 200
+
+
+@api.route("/api/cache/stats/")
+def get_response_cache_stats():
+    """
+    Hit ratio and size of the restaurant response cache
+    """
+    return json.dumps(response_cache.stats()), 200
+
+
+@api.route("/api/receipts/", methods=["POST"])
 def upload_receipt():
+    """
+    Queues a receipt image for parsing and returns the job to poll
+    """
     if "image" not in request.files:
         return {"error": "No image uploaded"}, 400
 
     image_bytes = request.files["image"].read()
+    job = receipt_jobs.submit(image_bytes)
+    return job.serialize(), 202
 
-    try:
-        result = parse_receipt(image_bytes)
-
-        if isinstance(result, str):
-            result = json.loads(result)
-
-        for idx, item in enumerate(result.get("items", []), start=1):
-            item["id"] = idx
 
-        result["assigned_friends"] = []
-
-        return result, 200
-    except Exception as e:
-        return {"error": str(e)}, 500
+@api.route("/api/receipts/stats/")
+def get_receipt_stats():
+    """
+    Gets token use, latency and repair rate of receipt parsing
+    """
+    return json.dumps(receipt_jobs.stats()), 200
 
 
-@app.route("/api/food/<int:food_id>/image/", methods=["POST"])
+@api.route("/api/receipts/<string:job_id>/")
+def get_receipt_job(job_id):
+    """
+    Gets a receipt parsing job, long-polling up to ?wait= seconds (at most 30)
+    for it to finish
+    """
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return {"error": "Invalid wait"}, 400
+    # nan and inf would never reach the deadline
+    if not math.isfinite(wait):
+        return {"error": "Invalid wait"}, 400
+    wait = min(max(wait, 0), 30)
+    job = receipt_jobs.get(job_id, wait)
+    if job is None:
+        return {"error": "Job not found!"}, 404
+    return job.serialize(), 200
+
+
+@api.route("/api/food/<int:food_id>/image/", methods=["POST"])
 def update_food_image(food_id):
     """
     Updates the image URL of a food item
@@ -482,10 +815,11 @@ def update_food_image(food_id):
 
     food.image_url = new_url
     db.session.commit()
+    response_cache.invalidate_restaurant(food.restaurant_id)
     return json.dumps(food.serialize()), 200
 
 
-@app.route("/api/food/<int:food_id>/category/", methods=["POST"])
+@api.route("/api/food/<int:food_id>/category/", methods=["POST"])
 def update_food_category(food_id):
     """
     Updates the categy of a food item
@@ -497,215 +831,145 @@ def update_food_category(food_id):
     body = json.loads(request.data)
     category = body.get("category")
 
-    if not update_food_category:
+    if not category:
         return json.dumps({"error": "category not provided!"}), 400
 
     food.category = category
     db.session.commit()
+    category_catalog.invalidate()
+    response_cache.invalidate_restaurant(food.restaurant_id)
     return json.dumps(food.serialize()), 200
 
 
 ## end of routes
 
 
-def convert(restaurant_name, item_name):
-    all_restaurants = Restaurant.query.all()
-    restaurant_names = [r.name for r in all_restaurants]
-    best_restaurant_name = get_closest_match(
-        restaurant_name, restaurant_names, context="restaurant names"
+def resolve_restaurant(restaurant_name):
+    """
+    Finds the restaurant whose name best matches a receipt's store name
+    """
+    restaurant_names = [name for (name,) in db.session.query(Restaurant.name)]
+    best_restaurant_name = match_cache.get_or_compute(
+        RESTAURANT_SCOPE,
+        restaurant_name,
+        restaurant_names,
+        lambda: find_closest_match(
+            restaurant_name, restaurant_names, context="restaurant names"
+        ),
     )
 
     if not best_restaurant_name:
-        return None, None
-
-    matched_restaurant = Restaurant.query.filter_by(name=best_restaurant_name).first()
-    if matched_restaurant is None:
-        return None, None
-
-    menu_items = matched_restaurant.menu
-    item_names = [item.name for item in menu_items]
-    best_item_name = get_closest_match(
-        item_name, item_names, context="food items from the restaurant menu"
-    )
-
-    return matched_restaurant.name, best_item_name
-
-
-def scrape_pho_time_data(
-    url="https://www.ithacatogo.com/order/restaurant/pho-time-vietnamese-menu/45",
-):
-    """Scrape restaurant and menu data from Pho Time using BeautifulSoup."""
-    try:
-        print(f"Accessing {url}...")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers)
-
-        if response.status_code != 200:
-            print(f"Failed to retrieve the page. Status code: {response.status_code}")
-            return None
-
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        restaurant_info = soup.find(class_="media-heading")
-        if not restaurant_info:
-            print("Could not find restaurant info section")
-            return None
+        return None
+    return Restaurant.query.filter_by(name=best_restaurant_name).first()
 
-        restaurant_name = restaurant_info.text.strip()
 
-        restaurant_info = soup.find(class_="media-body")
-        address_elem = restaurant_info.find(class_="restaurant_menu_info-addresss")
-        restaurant_address = (
-            address_elem.text.strip() if address_elem else "Unknown Address, Ithaca, NY"
+def load_menu_names(restaurant_id):
+    return [
+        name
+        for (name,) in db.session.query(Food.name).filter_by(
+            restaurant_id=restaurant_id
         )
+    ]
 
-        print(f"Restaurant: {restaurant_name}")
-        print(f"Address: {restaurant_address}")
-
-        menu_data = []
 
-        categories = soup.find_all(
-            class_="order_restaurant--restaurant_headings panel panel-default"
-        )
+def convert(restaurant_name, item_name):
+    matched_restaurant = resolve_restaurant(restaurant_name)
+    if matched_restaurant is None:
+        return None, None
 
-        for category in categories:
-            # print(category)
-            # category_name = category.find('h3').text.strip()
-            # print(f"\nCategory: {category_name}")
-
-            # Find menu items within this category
-            menu_items = category.find_all(
-                class_="order_restaurant--menu_item clearfix"
-            )
-            for item in menu_items:
-                try:
-                    item_title = item.find(class_="order_restaurant--menu_item_name")
-                    print(item_title.text.strip())
-                    if not item_title:
-                        continue
-                    item_name = item_title.text.strip()
-
-                    price_elem = item.find(class_="menu_item_price")
-                    print(price_elem.text.strip())
-                    price_text = price_elem.text.strip() if price_elem else "0.0"
-
-                    price_match = re.search(r"\$(\d+\.\d+)", price_text)
-                    if price_match:
-                        item_price = float(price_match.group(1))
-                    else:
-                        try:
-                            item_price = float(price_text.replace("$", "").strip())
-                        except ValueError:
-                            item_price = 0.0
-
-                    avg_rating = 0
-
-                    menu_data.append(
-                        {
-                            "name": item_name,
-                            "price": item_price,
-                            "category": "tbd",
-                            "description": "tbd",
-                            "image_url": "fakeurl",
-                            "avg_rating": avg_rating,
-                        }
-                    )
-
-                    print(f"  - {item_name}: ${item_price}")
-
-                except Exception as e:
-                    print(f"Error extracting menu item: {e}")
-                    continue
-
-        return {
-            "restaurant": {"name": restaurant_name, "address": restaurant_address},
-            "menu_items": menu_data,
-        }
+    item_names = load_menu_names(matched_restaurant.id)
+    best_item_name = match_cache.get_or_compute(
+        menu_scope(matched_restaurant.id),
+        item_name,
+        item_names,
+        lambda: find_closest_match(
+            item_name, item_names, context="food items from the restaurant menu"
+        ),
+    )
 
-    except Exception as e:
-        print(f"An error occurred during scraping: {e}")
-        return None
+    return matched_restaurant.name, best_item_name
 
 
-def insert_into_database(data):
-    """Insert scraped data into the database."""
-    if not data:
-        print("No data to insert into database.")
-        return False
+def convert_batch(restaurant_name, item_names):
+    """
+    Matches every receipt line against the restaurant's menu in one pass. Lines
+    the local matcher is confident about are answered directly, then the match
+    cache is consulted, and whatever remains goes to the LLM in a single prompt.
+    """
+    matched_restaurant = resolve_restaurant(restaurant_name)
+    if matched_restaurant is None:
+        return None, None
 
-    try:
-        existing_restaurant = Restaurant.query.filter_by(
-            name=data["restaurant"]["name"]
-        ).first()
-
-        if False:
-            print(
-                f"Restaurant {data['restaurant']['name']} already exists. Skipping insert."
-            )
-            restaurant = existing_restaurant
+    menu_names = load_menu_names(matched_restaurant.id)
+    scope = menu_scope(matched_restaurant.id)
+    matcher = get_matcher(tuple(menu_names))
+    results = []
+    unresolved = []
+    for i, item_name in enumerate(item_names):
+        best_item_name, confidence = matcher.match(item_name)
+        result = {"input": item_name, "item": None, "confidence": confidence}
+        if best_item_name is not None and confidence >= MATCH_THRESHOLD:
+            result.update(item=best_item_name, source="local")
         else:
-            restaurant = Restaurant(
-                name=data["restaurant"]["name"], address=data["restaurant"]["address"]
-            )
-
-            db.session.add(restaurant)
-            db.session.flush()
-
-        for item in data["menu_items"]:
-            existing_food = Food.query.filter_by(
-                name=item["name"], restaurant_id=restaurant.id
-            ).first()
-
-            if existing_food:
-                print(f"Food item {item['name']} already exists. Skipping insert.")
-                continue
-
-            food = Food(
-                name=item["name"],
-                price=item["price"],
-                category=item["category"],
-                image_url=item["image_url"],
-                avg_rating=item["avg_rating"],
-                restaurant_id=restaurant.id,
-            )
-            db.session.add(food)
-
-        # Commit all changes
-        db.session.commit()
-        print(
-            f"Successfully added {data['restaurant']['name']} with menu items to database."
+            key = match_cache.key(scope, item_name, menu_names)
+            cached = match_cache.get(key)
+            if cached is not None:
+                result.update(item=cached, source="cache")
+            else:
+                unresolved.append((i, key))
+        results.append(result)
+
+    if unresolved:
+        matches = get_closest_matches(
+            [item_names[i] for i, _ in unresolved],
+            menu_names,
+            context="food items from the restaurant menu",
         )
-        return True
-
-    except Exception as e:
-        db.session.rollback()
-        print(f"Database error: {e}")
-        return False
-
-
-def run_scraper():
-    """Run the scraper and insert data into the database."""
-    print("Starting scraper...")
-    scraped_data = scrape_pho_time_data()
+        for (i, key), match in zip(unresolved, matches):
+            results[i].update(item=match, source="llm")
+            if match is not None:
+                match_cache.put(key, match, commit=False)
+        db.session.commit()
 
-    if scraped_data:
-        print("\nInserting data into database...")
-        success = insert_into_database(scraped_data)
-        return success
-    else:
-        print("Scraping failed. No data to insert.")
-        return False
+    return matched_restaurant.name, results
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run Flask app with optional scraper")
-    parser.add_argument("--scrape", action="store_true", help="Run scraper on startup")
+    parser.add_argument(
+        "--scrape",
+        nargs="*",
+        metavar="URL",
+        help="Refresh the given menu pages (or every known page) on startup",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Apply new columns, keys and indexes to an existing database",
+    )
+    parser.add_argument(
+        "--backfill-ratings",
+        action="store_true",
+        help="Recompute every food's rating aggregates from its reviews",
+    )
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+
+    # The development server sets up the schema itself
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            create_search_index(connection)
+        if args.migrate:
+            migrate()
+        if args.backfill_ratings:
+            backfill_ratings()
+    start_background_workers(app)
 
     # Run the scraper if --scrape flag is provided
-    if args.scrape:
+    if args.scrape is not None:
         with app.app_context():
-            run_scraper()
+            print(scraper.run(args.scrape or None))
+    # Development server only; production runs under gunicorn, see gunicorn.conf.py
     app.run(host="0.0.0.0", port=5000, debug=True)
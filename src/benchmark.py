@@ -0,0 +1,762 @@
+"""
+Benchmarks for the hot paths of the munch backend. Each one builds its own
+throwaway SQLite database, so it never touches munch.db.
+
+    python benchmark.py indexes --foods 100000
+    python benchmark.py match
+    python benchmark.py images receipt.png photos/*.jpg
+    python benchmark.py scrape --items 500 5000
+    python benchmark.py startup
+    python benchmark.py serialize --foods 10000
+    python benchmark.py search --foods 1000000
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
+from bs4 import BeautifulSoup
+from flask import Flask
+from PIL import Image
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload, selectinload
+
+from convert import MATCH_THRESHOLD, FuzzyMatcher
+from db import db, Restaurant, Food, User, UserFoodReview
+from receiptparser import preprocess_image
+from menuparser import parse_menu
+from fastjson import food_dict, food_rows, restaurant_dicts, restaurant_rows
+from search import (
+    SEARCH_BUDGET_MS,
+    SearchTooBroad,
+    fts_search,
+    like_search,
+    match_expression,
+    search_terms,
+)
+
+# A Pho Time style menu and receipt lines as printed by point-of-sale systems,
+# paired with the menu item each one should resolve to
+MENU_FIXTURE = [
+    "Chicken Wings (6)",
+    "Spring Rolls (2)",
+    "Summer Rolls (2)",
+    "Fried Dumplings (6)",
+    "Crab Rangoon (5)",
+    "P1. House Pho 1 - Pho Xe Lua",
+    "P2. House Pho 2",
+    "P3. Pho Tai - Rare Steak",
+    "P4. Pho Chin - Well Done Brisket",
+    "P5. Pho Bo Vien - Beef Balls",
+    "P6. Pho Tai Nam - Rare Steak and Flank",
+    "P7. Pho Ga - Chicken",
+    "P12. Chicken Pho",
+    "P13. Seafood Pho",
+    "P14. Vegetable Pho",
+    "B1. Bun Bo Hue",
+    "B2. Grilled Pork Vermicelli",
+    "B3. Grilled Chicken Vermicelli",
+    "R1. Grilled Pork Rice Plate",
+    "R2. Lemongrass Chicken Rice Plate",
+    "R3. Shaking Beef Rice",
+    "Banh Mi - Grilled Pork",
+    "Banh Mi - Lemongrass Chicken",
+    "Vietnamese Iced Coffee",
+    "Thai Iced Tea",
+    "Taro Bubble Tea",
+    "Mango Smoothie",
+    "Fountain Soda",
+]
+RECEIPT_FIXTURE = [
+    ("CHKN WINGS 6PC", "Chicken Wings (6)"),
+    ("chicken wings", "Chicken Wings (6)"),
+    ("SPRING ROLL", "Spring Rolls (2)"),
+    ("SUMMER RL 2", "Summer Rolls (2)"),
+    ("FRD DUMPLING", "Fried Dumplings (6)"),
+    ("CRAB RANGOON", "Crab Rangoon (5)"),
+    ("P1 HOUSE PHO XE LUA", "P1. House Pho 1 - Pho Xe Lua"),
+    ("HOUSE PHO 2 LG", "P2. House Pho 2"),
+    ("PHO TAI LG", "P3. Pho Tai - Rare Steak"),
+    ("P4 PHO CHIN", "P4. Pho Chin - Well Done Brisket"),
+    ("PHO BO VIEN", "P5. Pho Bo Vien - Beef Balls"),
+    ("PHO TAI NAM SM", "P6. Pho Tai Nam - Rare Steak and Flank"),
+    ("PHO GA", "P7. Pho Ga - Chicken"),
+    ("P12 CHICKEN PHO", "P12. Chicken Pho"),
+    ("SEAFOOD PHO LG", "P13. Seafood Pho"),
+    ("VEG PHO", "P14. Vegetable Pho"),
+    ("BUN BO HUE", "B1. Bun Bo Hue"),
+    ("GRLD PORK VERMICELLI", "B2. Grilled Pork Vermicelli"),
+    ("GRILLED CHKN VERM", "B3. Grilled Chicken Vermicelli"),
+    ("PORK RICE PLATE", "R1. Grilled Pork Rice Plate"),
+    ("LEMONGRASS CHKN RICE", "R2. Lemongrass Chicken Rice Plate"),
+    ("SHAKING BEEF", "R3. Shaking Beef Rice"),
+    ("BANH MI PORK", "Banh Mi - Grilled Pork"),
+    ("BANH MI LEMONGRASS CHK", "Banh Mi - Lemongrass Chicken"),
+    ("VIET ICED COFFEE", "Vietnamese Iced Coffee"),
+    ("THAI TEA", "Thai Iced Tea"),
+    ("TARO BBL TEA", "Taro Bubble Tea"),
+    ("MANGO SMTHIE", "Mango Smoothie"),
+    ("SODA", "Fountain Soda"),
+]
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % path
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def seed(foods, restaurants=500, categories=50, users=1000, reviews=50000):
+    """
+    Bulk-inserts a synthetic catalog with the given number of rows
+    """
+    rng = random.Random(0)
+    db.session.execute(
+        Restaurant.__table__.insert(),
+        [
+            {"name": "Restaurant %d" % i, "address": "Ithaca, NY", "image_url": ""}
+            for i in range(1, restaurants + 1)
+        ],
+    )
+    db.session.execute(
+        Food.__table__.insert(),
+        [
+            {
+                "name": "Food %d" % i,
+                "price": rng.uniform(5, 20),
+                "category": "Category %d" % rng.randrange(categories),
+                "image_url": "",
+                "avg_rating": 0,
+                "rating_sum": 0,
+                "review_count": 0,
+                "restaurant_id": rng.randint(1, restaurants),
+            }
+            for i in range(1, foods + 1)
+        ],
+    )
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            {
+                "username": "user%d" % i,
+                "password": "",
+                "email": "",
+                "phone": 0,
+                "venmo": "",
+                "profile_image": "",
+            }
+            for i in range(1, users + 1)
+        ],
+    )
+    pairs = {(rng.randint(1, users), rng.randint(1, foods)) for _ in range(reviews)}
+    if pairs:
+        db.session.execute(
+            UserFoodReview.__table__.insert(),
+            [
+                {"user_id": u, "food_id": f, "rating": rng.randint(1, 5), "review": ""}
+                for u, f in pairs
+            ],
+        )
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    """
+    Returns the mean latency of fn in milliseconds
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench_indexes(args):
+    lookups = {
+        "category": lambda i: Food.query.filter_by(
+            category="Category %d" % (i % 50)
+        ).all(),
+        "menu": lambda i: Food.query.filter_by(restaurant_id=i % 500 + 1).all(),
+        "restaurant by name": lambda i: Restaurant.query.filter_by(
+            name="Restaurant %d" % (i % 500 + 1)
+        ).first(),
+        "food reviews": lambda i: UserFoodReview.query.filter_by(
+            food_id=i * 7919 % args.foods + 1
+        ).all(),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            db.create_all()
+            seed(args.foods)
+            indexes = [
+                index for table in db.metadata.sorted_tables for index in table.indexes
+            ]
+
+            with db.engine.begin() as connection:
+                for index in indexes:
+                    index.drop(connection)
+            before = {name: timed(fn, args.repeat) for name, fn in lookups.items()}
+
+            with db.engine.begin() as connection:
+                for index in indexes:
+                    index.create(connection)
+                connection.execute(text("ANALYZE"))
+            after = {name: timed(fn, args.repeat) for name, fn in lookups.items()}
+
+    print("%-20s %12s %12s" % ("lookup", "no index ms", "indexed ms"))
+    for name in lookups:
+        print("%-20s %12.3f %12.3f" % (name, before[name], after[name]))
+
+
+def bench_match(args):
+    start = time.perf_counter()
+    matcher = FuzzyMatcher(MENU_FIXTURE)
+    build_us = (time.perf_counter() - start) * 1e6
+
+    correct = local = local_correct = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        results = [matcher.match(line) for line, _ in RECEIPT_FIXTURE]
+    match_us = (
+        (time.perf_counter() - start) * 1e6 / (args.repeat * len(RECEIPT_FIXTURE))
+    )
+
+    for (line, expected), (best, score) in zip(RECEIPT_FIXTURE, results):
+        correct += best == expected
+        if score >= args.threshold:
+            local += 1
+            local_correct += best == expected
+        elif args.verbose:
+            print("fallback: %-24s -> %s (%.2f)" % (line, best, score))
+
+    total = len(RECEIPT_FIXTURE)
+    print("index build        %10.1f us" % build_us)
+    print("match latency      %10.1f us" % match_us)
+    print("top-1 accuracy     %9.1f%%" % (100 * correct / total))
+    print(
+        "answered locally   %9.1f%% (threshold %.2f)"
+        % (100 * local / total, args.threshold)
+    )
+    print("local accuracy     %9.1f%%" % (100 * local_correct / max(local, 1)))
+
+
+def legacy_encode(image_bytes, max_size=1024):
+    """
+    encode_image as it was first written: full decode, LANCZOS, PNG
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    scale = min(max_size / width, max_size / height)
+    if scale < 1:
+        image = image.resize(
+            (int(width * scale), int(height * scale)), Image.Resampling.LANCZOS
+        )
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def measure_encode(path, legacy, repeat):
+    """
+    Runs in a fresh process so ru_maxrss reflects this encoder alone
+    """
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if legacy:
+            payload = legacy_encode(image_bytes)
+        else:
+            payload, _ = preprocess_image(image_bytes)
+    latency = (time.perf_counter() - start) * 1000 / repeat
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    return latency, peak_rss, len(base64.b64encode(payload))
+
+
+def bench_images(args):
+    print(
+        "%-24s %-8s %10s %14s %14s"
+        % ("image", "encoder", "latency ms", "peak rss +KiB", "payload bytes")
+    )
+    for path in args.paths:
+        for legacy in (True, False):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                latency, peak_rss, size = pool.submit(
+                    measure_encode, path, legacy, args.repeat
+                ).result()
+            print(
+                "%-24s %-8s %10.1f %14d %14d"
+                % (
+                    os.path.basename(path)[:24],
+                    "legacy" if legacy else "new",
+                    latency,
+                    peak_rss,
+                    size,
+                )
+            )
+
+
+def legacy_parse(html):
+    """
+    The scraper's parsing as it was first written: html.parser over the whole
+    page, find_all class searches and two prints per item
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    restaurant_name = soup.find(class_="media-heading").text.strip()
+    address_elem = soup.find(class_="media-body").find(
+        class_="restaurant_menu_info-addresss"
+    )
+    restaurant_address = (
+        address_elem.text.strip() if address_elem else "Unknown Address, Ithaca, NY"
+    )
+    print(f"Restaurant: {restaurant_name}")
+    print(f"Address: {restaurant_address}")
+    menu_data = []
+    for category in soup.find_all(
+        class_="order_restaurant--restaurant_headings panel panel-default"
+    ):
+        for item in category.find_all(class_="order_restaurant--menu_item clearfix"):
+            item_title = item.find(class_="order_restaurant--menu_item_name")
+            print(item_title.text.strip())
+            item_name = item_title.text.strip()
+            price_elem = item.find(class_="menu_item_price")
+            print(price_elem.text.strip())
+            price_text = price_elem.text.strip() if price_elem else "0.0"
+            price_match = re.search(r"\$(\d+\.\d+)", price_text)
+            if price_match:
+                item_price = float(price_match.group(1))
+            else:
+                try:
+                    item_price = float(price_text.replace("$", "").strip())
+                except ValueError:
+                    item_price = 0.0
+            menu_data.append({"name": item_name, "price": item_price})
+            print(f"  - {item_name}: ${item_price}")
+    return {
+        "restaurant": {"name": restaurant_name, "address": restaurant_address},
+        "menu_items": menu_data,
+    }
+
+
+def grow_menu(html, items):
+    """
+    Repeats a saved page's menu panels, renaming their items, until the page
+    lists at least items dishes
+    """
+    panels = re.findall(
+        r'<div class="order_restaurant--restaurant_headings.*?\n  </div>\n',
+        html,
+        re.S,
+    )
+    per_copy = sum(panel.count("menu_item_name") for panel in panels)
+    copies = [
+        re.sub(r'(menu_item_name">)([^<]*)', r"\g<1>\g<2> #%d" % copy, "".join(panels))
+        for copy in range(1, -(-items // per_copy))
+    ]
+    end = html.rindex("</div>\n</body>")
+    return html[:end] + "".join(copies) + html[end:]
+
+
+def measure_parse(legacy, html, repeat):
+    """
+    Runs in a fresh process so ru_maxrss reflects this parser alone, including
+    lxml's C allocations
+    """
+    parse = legacy_parse if legacy else parse_menu
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = parse(html)
+        latency = (time.perf_counter() - start) * 1000 / repeat
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    return latency, peak_rss, len(result["menu_items"])
+
+
+def bench_scrape(args):
+    with open(args.page, encoding="utf-8") as f:
+        html = f.read()
+    pages = [(os.path.basename(args.page), html)]
+    pages += [("%d items" % items, grow_menu(html, items)) for items in args.items]
+
+    print(
+        "%-24s %-8s %8s %10s %14s"
+        % ("page", "parser", "items", "latency ms", "peak rss +KiB")
+    )
+    for name, page in pages:
+        for legacy in (True, False):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                latency, peak_rss, count = pool.submit(
+                    measure_parse, legacy, page, args.repeat
+                ).result()
+            print(
+                "%-24s %-8s %8d %10.2f %14d"
+                % (name[:24], "legacy" if legacy else "new", count, latency, peak_rss)
+            )
+
+
+# VmHWM rather than ru_maxrss, which a child inherits from the process that
+# forked it
+COLD_START = """
+import re, time
+start = time.perf_counter()
+import wsgi
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    print(elapsed, re.search(r"VmHWM:\\s+(\\d+)", f.read()).group(1))
+"""
+
+
+def memory_kib(pid):
+    """
+    RSS, PSS and private memory of a process, from /proc (Linux only)
+    """
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        fields = dict(re.findall(r"^(\w+):\s+(\d+) kB", f.read(), re.M))
+    private = int(fields["Private_Clean"]) + int(fields["Private_Dirty"])
+    return int(fields["Rss"]), int(fields["Pss"]), private
+
+
+def bench_startup(args):
+    src = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DATABASE_URL="sqlite:///%s" % os.path.join(directory, "startup.db"),
+            WEB_CONCURRENCY="1",
+            GUNICORN_BIND="127.0.0.1:%d" % args.port,
+            GUNICORN_LOGLEVEL="warning",
+        )
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "app", "init-db"],
+            cwd=src,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", COLD_START],
+                cwd=src,
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()
+            runs.append((float(output[0]) * 1000, int(output[1])))
+        print(
+            "cold import of wsgi: %.0f ms median, %d KiB peak RSS"
+            % (
+                statistics.median(ms for ms, _ in runs),
+                statistics.median(rss for _, rss in runs),
+            )
+        )
+
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+            cwd=src,
+            env=env,
+        )
+        try:
+            time.sleep(args.settle)
+            workers = subprocess.run(
+                ["pgrep", "-P", str(server.pid)], capture_output=True, text=True
+            ).stdout.split()
+            print(
+                "%-8s %10s %10s %14s" % ("process", "rss KiB", "pss KiB", "private KiB")
+            )
+            for name, pid in [("master", server.pid)] + [
+                ("worker", int(pid)) for pid in workers
+            ]:
+                print("%-8s %10d %10d %14d" % ((name,) + memory_kib(pid)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def bench_serialize(args):
+    """
+    Encodes the whole food and restaurant listings the way the routes used to
+    (ORM objects, serialize(), json.dumps) and the way they do now (column
+    tuples, orjson). The session is cleared before each run, like a request.
+    """
+    listings = {
+        "food": (
+            lambda: json.dumps(
+                {
+                    "food_items": [
+                        food.serialize()
+                        for food in Food.query.options(joinedload(Food.restaurant))
+                        .order_by(Food.id)
+                        .all()
+                    ]
+                }
+            ),
+            lambda: orjson.dumps(
+                {
+                    "food_items": [
+                        food_dict(row) for row in food_rows().order_by(Food.id)
+                    ]
+                }
+            ),
+        ),
+        "restaurants": (
+            lambda: json.dumps(
+                {
+                    "restaurants": [
+                        restaurant.serialize()
+                        for restaurant in Restaurant.query.options(
+                            selectinload(Restaurant.menu)
+                        )
+                        .order_by(Restaurant.id)
+                        .all()
+                    ]
+                }
+            ),
+            lambda: orjson.dumps(
+                {
+                    "restaurants": restaurant_dicts(
+                        restaurant_rows().order_by(Restaurant.id).all()
+                    )
+                }
+            ),
+        ),
+    }
+
+    def run(encode):
+        db.session.remove()
+        return encode()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            db.create_all()
+            seed(args.foods, reviews=0)
+            print(
+                "%-12s %8s %12s %12s %8s"
+                % ("listing", "KiB", "orm+json ms", "rows+orjson", "speedup")
+            )
+            for name, (legacy, fast) in listings.items():
+                body = run(fast)
+                if json.loads(run(legacy)) != json.loads(body):
+                    raise AssertionError("%s listings differ" % name)
+                before = timed(lambda i: run(legacy), args.repeat)
+                after = timed(lambda i: run(fast), args.repeat)
+                print(
+                    "%-12s %8d %12.1f %12.1f %7.1fx"
+                    % (name, len(body) / 1024, before, after, before / after)
+                )
+
+
+# Words menu items and restaurants are made of in the search benchmark
+STYLES = ["Spicy", "Crispy", "Grilled", "Steamed", "Fried", "Roasted", "Braised"]
+STYLES += ["Smoked", "Garlic", "Lemongrass", "Ginger", "Honey", "Sesame", "Basil"]
+PROTEINS = ["Chicken", "Beef", "Pork", "Shrimp", "Tofu", "Duck", "Salmon", "Lamb"]
+PROTEINS += ["Squid", "Vegetable", "Egg", "Brisket", "Crab", "Mushroom"]
+DISHES = ["Pho", "Ramen", "Fried Rice", "Noodles", "Curry", "Bowl", "Salad", "Bao"]
+DISHES += ["Sandwich", "Taco", "Dumplings", "Spring Rolls", "Soup", "Pad Thai"]
+CUISINES = ["Pho", "Thai", "Sushi", "Taco", "Curry", "Noodle", "Dumpling", "Ramen"]
+PLACES = ["House", "Kitchen", "Garden", "Palace", "Express", "Bistro", "Corner"]
+STREETS = ["Eddy", "College", "State", "Aurora", "Cayuga", "Buffalo", "Seneca"]
+SECTIONS = ["Appetizers", "Entrees", "Noodles", "Rice", "Soups", "Drinks", "Desserts"]
+
+SEARCH_QUERIES = ["pho", "chick", "spicy beef", "garlic shrimp fried rice"]
+SEARCH_QUERIES += ["thai kitchen", "eddy st", "dumpl", "crab rangoon", "ithaca"]
+
+
+def seed_menus(foods, restaurants):
+    """
+    Bulk-inserts restaurants with menus of distinct dish names drawn from the
+    word lists above, through the search index triggers
+    """
+    rng = random.Random(0)
+    db.session.execute(
+        Restaurant.__table__.insert(),
+        [
+            {
+                "name": "%s %s" % (rng.choice(CUISINES), rng.choice(PLACES)),
+                "address": "%d %s St, Ithaca, NY"
+                % (rng.randint(1, 999), rng.choice(STREETS)),
+                "image_url": "",
+            }
+            for _ in range(restaurants)
+        ],
+    )
+    names = [
+        "%s %s %s" % (style, protein, dish)
+        for style in STYLES
+        for protein in PROTEINS
+        for dish in DISHES
+    ]
+    per_restaurant = -(-foods // restaurants)
+    rows = []
+    for restaurant_id in range(1, restaurants + 1):
+        count = min(per_restaurant, foods - (restaurant_id - 1) * per_restaurant)
+        for name in rng.sample(names, max(count, 0)):
+            rows.append(
+                {
+                    "name": name,
+                    "price": rng.uniform(5, 20),
+                    "category": rng.choice(SECTIONS),
+                    "image_url": "",
+                    "avg_rating": 0,
+                    "rating_sum": 0,
+                    "review_count": 0,
+                    "restaurant_id": restaurant_id,
+                }
+            )
+        if len(rows) >= 50000 or restaurant_id == restaurants:
+            if rows:
+                db.session.execute(Food.__table__.insert(), rows)
+            rows = []
+    db.session.commit()
+
+
+def bench_search(args):
+    """
+    Latency of /api/search queries on the FTS5 index against a LIKE scan of
+    the same columns
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            seed_menus(args.foods, args.restaurants)
+            print(
+                "Seeded and indexed %d foods in %.1f s\n"
+                % (Food.query.count(), time.perf_counter() - start)
+            )
+            print(
+                "%-26s %9s %10s %10s %8s"
+                % ("query", "matches", "fts5 ms", "like ms", "speedup")
+            )
+            for query in args.queries:
+                terms = search_terms(query)
+                matches = db.session.execute(
+                    text("SELECT COUNT(*) FROM food_search WHERE food_search MATCH :m"),
+                    {"m": match_expression(terms)},
+                ).scalar()
+                like = timed(lambda i: like_search(terms, args.limit), args.like_repeat)
+                try:
+                    fts = timed(
+                        lambda i: fts_search(terms, args.limit, args.budget),
+                        args.repeat,
+                    )
+                except SearchTooBroad:
+                    db.session.rollback()
+                    print("%-26s %9d %10s %10.1f" % (query, matches, "too broad", like))
+                    continue
+                print(
+                    "%-26s %9d %10.2f %10.1f %7.0fx"
+                    % (query, matches, fts, like, like / fts)
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run munch backend benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    indexes = subparsers.add_parser(
+        "indexes", help="Lookup latency with and without the column indexes"
+    )
+    indexes.add_argument("--foods", type=int, default=100000)
+    indexes.add_argument("--repeat", type=int, default=200)
+    indexes.set_defaults(run=bench_indexes)
+
+    match = subparsers.add_parser(
+        "match", help="Accuracy and latency of the local fuzzy matcher"
+    )
+    match.add_argument("--threshold", type=float, default=MATCH_THRESHOLD)
+    match.add_argument("--repeat", type=int, default=1000)
+    match.add_argument("--verbose", action="store_true")
+    match.set_defaults(run=bench_match)
+
+    images = subparsers.add_parser(
+        "images", help="Latency, memory and payload size of receipt preprocessing"
+    )
+    images.add_argument(
+        "paths",
+        nargs="*",
+        default=[
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+            for name in ("receipt.png", "pho_receipt.png")
+        ],
+    )
+    images.add_argument("--repeat", type=int, default=5)
+    images.set_defaults(run=bench_images)
+
+    scrape = subparsers.add_parser(
+        "scrape", help="Parse time and memory of the menu scraper on saved pages"
+    )
+    scrape.add_argument(
+        "--page",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "pho_time_menu.html"
+        ),
+        help="Saved ithacatogo menu page",
+    )
+    scrape.add_argument(
+        "--items",
+        type=int,
+        nargs="*",
+        default=[500, 5000],
+        help="Also parse copies of the page grown to this many menu items",
+    )
+    scrape.add_argument("--repeat", type=int, default=5)
+    scrape.set_defaults(run=bench_scrape)
+
+    startup = subparsers.add_parser(
+        "startup", help="Cold import time and idle gunicorn worker memory"
+    )
+    startup.add_argument("--repeat", type=int, default=7)
+    startup.add_argument("--port", type=int, default=5098)
+    startup.add_argument(
+        "--settle", type=float, default=5, help="Seconds to let the workers idle"
+    )
+    startup.set_defaults(run=bench_startup)
+
+    serialize = subparsers.add_parser(
+        "serialize", help="Listing encode time, ORM + json versus rows + orjson"
+    )
+    serialize.add_argument("--foods", type=int, default=10000)
+    serialize.add_argument("--repeat", type=int, default=10)
+    serialize.set_defaults(run=bench_serialize)
+
+    search = subparsers.add_parser(
+        "search", help="Food search latency, FTS5 index versus LIKE scan"
+    )
+    search.add_argument("--foods", type=int, default=1000000)
+    search.add_argument("--restaurants", type=int, default=5000)
+    search.add_argument("--queries", nargs="+", default=SEARCH_QUERIES)
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--repeat", type=int, default=50)
+    search.add_argument("--like-repeat", type=int, default=3)
+    search.add_argument(
+        "--budget",
+        type=float,
+        default=SEARCH_BUDGET_MS,
+        help="Ranking budget in ms, 0 for none",
+    )
+    search.set_defaults(run=bench_search)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from sqlalchemy import func
+from db import db, Food
+from responsecache import response_cache
+
+# Seconds the counts are served for; bounds how stale another worker's copy
+# can be when the response cache has no Redis to share invalidations through
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", "60"))
+
+CATEGORIES_SCOPE = "categories"
+
+
+class CategoryCatalog:
+    """
+    Caches the distinct food categories with their food counts. Write paths that
+    add, remove or recategorize foods call invalidate() after committing, which
+    bumps the categories generation in the response cache's backend, so with
+    Redis every worker recomputes on its next read.
+    """
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (generation, expiry, counts)
+        self._entry = None
+
+    def get(self):
+        """
+        Returns a dict of category -> number of foods, ordered by category
+        """
+        generation = response_cache.backend.generation(CATEGORIES_SCOPE)
+        entry = self._entry
+        if entry is not None and entry[0] == generation and entry[1] > time.monotonic():
+            return entry[2]
+        rows = (
+            db.session.query(Food.category, func.count(Food.id))
+            .group_by(Food.category)
+            .order_by(Food.category)
+            .all()
+        )
+        counts = dict(rows)
+        # A result an invalidate() raced past is stored under the old
+        # generation, so it's never served
+        if generation is not None and self.ttl > 0:
+            with self._lock:
+                self._entry = (generation, time.monotonic() + self.ttl, counts)
+        return counts
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+        response_cache.invalidate(CATEGORIES_SCOPE)
+
+
+category_catalog = CategoryCatalog()
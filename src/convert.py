@@ -1,13 +1,114 @@
-import openai
 import os
-from openai import OpenAI
+import re
+import json
+from collections import Counter
+from functools import lru_cache
 from dotenv import load_dotenv
+from outbound import chat_completion
 
 load_dotenv()
 
-# Create OpenAI client
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+# Local matches scoring below this fall back to the LLM
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.6"))
+
+
+def normalize(text):
+    """
+    Lowercases text and reduces punctuation to single spaces, so receipt and
+    menu spellings of the same item compare equal
+    """
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.lower()).split())
+
+
+def trigrams(text):
+    padded = "  %s " % text
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def token_overlap(target_tokens, option_tokens):
+    """
+    Fraction of the target's tokens found in the option, counting abbreviations
+    such as "chkn" -> "chicken" or "lg" -> "large" by shared prefix or letters
+    """
+    if not target_tokens:
+        return 0.0
+    found = 0
+    for token in target_tokens:
+        for option_token in option_tokens:
+            if option_token.startswith(token) or token.startswith(option_token):
+                found += 1
+                break
+            if token[0] == option_token[0] and is_subsequence(token, option_token):
+                found += 1
+                break
+    return found / len(target_tokens)
+
+
+def is_subsequence(short, long):
+    letters = iter(long)
+    return all(letter in letters for letter in short)
+
+
+class FuzzyMatcher:
+    """
+    In-process fuzzy matcher over a fixed list of names. Names are indexed by
+    character trigram, and a query only scores the names that share a trigram
+    with it, blending trigram similarity with token overlap.
+    """
+
+    def __init__(self, options):
+        self.options = list(options)
+        self._tokens = []
+        self._trigrams = []
+        self._index = {}
+        for i, option in enumerate(self.options):
+            normalized = normalize(option)
+            grams = trigrams(normalized)
+            self._tokens.append(normalized.split())
+            self._trigrams.append(len(grams))
+            for gram in grams:
+                self._index.setdefault(gram, []).append(i)
+
+    def match(self, target):
+        """
+        Returns the best matching option and its score in [0, 1], or
+        (None, 0.0) if nothing is similar
+        """
+        normalized = normalize(target)
+        grams = trigrams(normalized)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._index.get(gram, ()))
+        tokens = normalized.split()
+        best, best_score = None, 0.0
+        for i, count in shared.items():
+            dice = 2 * count / (len(grams) + self._trigrams[i])
+            score = (dice + token_overlap(tokens, self._tokens[i])) / 2
+            if score > best_score:
+                best, best_score = self.options[i], score
+        return best, best_score
+
+
+@lru_cache(maxsize=64)
+def get_matcher(options):
+    """
+    Matchers are cached by their (tuple of) options, so an unchanged list of
+    restaurants or menu items is only indexed once
+    """
+    return FuzzyMatcher(options)
+
+
+def find_closest_match(target_string, options_list, context="", threshold=None):
+    """
+    Returns the string in options_list most similar to target_string, asking the
+    LLM only when the local matcher's best score is below the threshold
+    """
+    if threshold is None:
+        threshold = MATCH_THRESHOLD
+    best_match, score = get_matcher(tuple(options_list)).match(target_string)
+    if best_match is not None and score >= threshold:
+        return best_match
+    return get_closest_match(target_string, options_list, context=context)
 
 
 def get_closest_match(target_string, options_list, context=""):
@@ -25,7 +126,7 @@ Context (if any): {context}
 Return only the best matching string. Do not include any explanation or extra text.
 """
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {
@@ -43,3 +144,49 @@ Return only the best matching string. Do not include any explanation or extra te
     except Exception as e:
         print(f"OpenAI API Error: {e}")
         return None
+
+
+def get_closest_matches(target_strings, options_list, context=""):
+    """
+    Uses a single OpenAI call to return the most similar string in options_list
+    for each of target_strings, in order. Unmatched targets map to None.
+    """
+    options_string = "\n".join(options_list)
+    targets_string = "\n".join(
+        f"{i}. {target}" for i, target in enumerate(target_strings, start=1)
+    )
+    prompt = f"""
+You are helping identify the best match for each of several names from a list.
+For each numbered input below, choose the closest matching string from the following list:
+{options_string}
+
+Inputs:
+{targets_string}
+
+Context (if any): {context}
+
+Return only a JSON array with one best matching string per input, in the same order. Do not include any explanation or extra text.
+"""
+    try:
+        response = chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant for fuzzy matching.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.0,
+        )
+
+        content = response.choices[0].message.content
+        match = re.search(r"\[.*\]", content, re.DOTALL)
+        matches = json.loads(match.group(0) if match else content)
+        if not isinstance(matches, list) or len(matches) != len(target_strings):
+            raise ValueError("Expected %d matches" % len(target_strings))
+        return [m if m in options_list else None for m in matches]
+
+    except Exception as e:
+        print(f"OpenAI API Error: {e}")
+        return [None] * len(target_strings)
@@ -1,30 +1,53 @@
+import json
+import logging
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import cast, event, inspect, text, update
+from sqlalchemy.orm import selectinload
+from dbconfig import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
+logger = logging.getLogger(__name__)
 
+# Sections of a serialized user profile that can be requested individually
+PROFILE_SECTIONS = (
+    "foods",
+    "favorites",
+    "sent_requests",
+    "received_requests",
+    "reviews",
+)
+
+
+# The composite primary keys keep a user from favoriting or logging the same food
+# twice and index lookups by user; food_id gets its own index for reverse lookups
 favorites_table = db.Table(
     "favorites",
     db.Model.metadata,
-    db.Column("user_id", db.Integer, db.ForeignKey("users.id")),
-    db.Column("food_id", db.Integer, db.ForeignKey("foods.id")),
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column(
+        "food_id", db.Integer, db.ForeignKey("foods.id"), primary_key=True, index=True
+    ),
 )
 
 user_food_association_table = db.Table(
     "user_food",
     db.Model.metadata,
-    db.Column("user_id", db.Integer, db.ForeignKey("users.id")),
-    db.Column("food_id", db.Integer, db.ForeignKey("foods.id")),
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column(
+        "food_id", db.Integer, db.ForeignKey("foods.id"), primary_key=True, index=True
+    ),
 )
 
 
 class Restaurant(db.Model):
     __tablename__ = "restaurants"
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, nullable=False)
+    name = db.Column(db.String, nullable=False, index=True)
     address = db.Column(db.String, nullable=False)
     image_url = db.Column(db.String, nullable=False)
-    menu = db.relationship("Food", cascade="delete")
+    menu = db.relationship("Food", cascade="delete", back_populates="restaurant")
 
     def __init__(self, **kwargs):
         self.name = kwargs.get("name", "")
@@ -50,15 +73,23 @@ class Restaurant(db.Model):
 
 class Food(db.Model):
     __tablename__ = "foods"
+    # One row per dish on a menu; the scraper upserts against this key, and it
+    # also serves lookups by restaurant
+    __table_args__ = (
+        db.Index("ix_foods_restaurant_id_name", "restaurant_id", "name", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     price = db.Column(db.Float, nullable=False)
-    category = db.Column(db.String, nullable=False)
+    category = db.Column(db.String, nullable=False, index=True)
     image_url = db.Column(db.String, nullable=False)
-    avg_rating = db.Column(db.Integer, nullable=False)
+    avg_rating = db.Column(db.Float, nullable=False)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     restaurant_id = db.Column(
         db.Integer, db.ForeignKey("restaurants.id"), nullable=False
     )
+    restaurant = db.relationship("Restaurant", back_populates="menu")
     user_reviews = db.relationship("UserFoodReview", back_populates="food")
     users = db.relationship(
         "User", secondary=user_food_association_table, back_populates="foods"
@@ -74,10 +105,27 @@ class Food(db.Model):
         self.restaurant_id = kwargs.get("restaurant_id", 0)
         self.image_url = kwargs.get("image_url", "")
         self.avg_rating = kwargs.get("avg_rating", "")
+        self.rating_sum = 0
+        self.review_count = 0
 
-    def update_avg_rating(self, new_avg_rating):
-        self.avg_rating = new_avg_rating
-        db.session.commit()
+    @staticmethod
+    def add_rating(food_id, rating):
+        """
+        Folds a new review's rating into a food's aggregates with a single
+        atomic UPDATE, so concurrent reviewers can't lose each other's update.
+        Runs inside the caller's transaction and does not commit.
+        """
+        db.session.execute(
+            update(Food)
+            .where(Food.id == food_id)
+            .values(
+                rating_sum=Food.rating_sum + rating,
+                review_count=Food.review_count + 1,
+                avg_rating=cast(Food.rating_sum + rating, db.Float)
+                / (Food.review_count + 1),
+            )
+            .execution_options(synchronize_session=False)
+        )
 
     def serialize(self):
         return {
@@ -87,9 +135,8 @@ class Food(db.Model):
             "category": self.category,
             "image_url": self.image_url,
             "avg_rating": self.avg_rating,
-            "restaurant": Restaurant.query.filter_by(id=self.restaurant_id)
-            .first()
-            .simple_serialize(),
+            "review_count": self.review_count,
+            "restaurant": self.restaurant.simple_serialize(),
         }
 
     def simple_serialize(self):
@@ -100,6 +147,7 @@ class Food(db.Model):
             "category": self.category,
             "image_url": self.image_url,
             "avg_rating": self.avg_rating,
+            "review_count": self.review_count,
         }
 
 
@@ -109,7 +157,7 @@ class User(db.Model):
     username = db.Column(db.String, nullable=False)
     password = db.Column(db.String, nullable=False)
     email = db.Column(db.String, nullable=False)
-    phone = db.Column(db.Integer, nullable=False)
+    phone = db.Column(db.BigInteger, nullable=False)
     venmo = db.Column(db.String, nullable=False)
     profile_image = db.Column(db.String, nullable=False)
 
@@ -136,46 +184,91 @@ class User(db.Model):
         self.venmo = kwargs.get("venmo", "")
         self.profile_image = kwargs.get("profile_image", "")
 
-    def serialize(self):
-        return {
+    @staticmethod
+    def profile_options(sections=PROFILE_SECTIONS):
+        """
+        Loader options that fetch each requested profile section in one batched
+        query instead of lazy loading it per user
+        """
+        options = []
+        if "foods" in sections:
+            options.append(selectinload(User.foods))
+        if "favorites" in sections:
+            options.append(selectinload(User.favorite_foods))
+        if "sent_requests" in sections:
+            options.append(selectinload(User.sent_requests))
+        if "received_requests" in sections:
+            options.append(selectinload(User.received_requests))
+        if "reviews" in sections:
+            options.append(
+                selectinload(User.food_reviews).joinedload(UserFoodReview.food)
+            )
+        return options
+
+    def serialize(self, sections=PROFILE_SECTIONS):
+        data = {
             "id": self.id,
             "username": self.username,
             "email": self.email,
             "phone": self.phone,
             "venmo": self.venmo,
             "profile_image": self.profile_image,
-            "foods": [food.simple_serialize() for food in self.foods],
-            "favorites": [food.simple_serialize() for food in self.favorite_foods],
-            "sent_requests": [sent.serialize() for sent in self.sent_requests],
-            "received_requests": [
+        }
+        if "foods" in sections:
+            data["foods"] = [food.simple_serialize() for food in self.foods]
+        if "favorites" in sections:
+            data["favorites"] = [
+                food.simple_serialize() for food in self.favorite_foods
+            ]
+        if "sent_requests" in sections:
+            data["sent_requests"] = [sent.serialize() for sent in self.sent_requests]
+        if "received_requests" in sections:
+            data["received_requests"] = [
                 received.serialize() for received in self.received_requests
-            ],
-            "reviews": [
+            ]
+        if "reviews" in sections:
+            data["reviews"] = [
                 {
                     "food": review.food.simple_serialize(),
                     "rating": review.rating,
                     "review": review.review,
                 }
                 for review in self.food_reviews
-            ],
-        }
+            ]
+        return data
 
 
 class UserFoodReview(db.Model):
     __tablename__ = "user_food_reviews"
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
-    food_id = db.Column(db.Integer, db.ForeignKey("foods.id"), primary_key=True)
+    food_id = db.Column(
+        db.Integer, db.ForeignKey("foods.id"), primary_key=True, index=True
+    )
     rating = db.Column(db.Integer, nullable=False)
     review = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     user = db.relationship("User", back_populates="food_reviews")
     food = db.relationship("Food", back_populates="user_reviews")
 
+    def serialize(self):
+        return {
+            "id": self.user.id,
+            "username": self.user.username,
+            "review": self.review,
+            "rating": self.rating,
+            "profile_image": self.user.profile_image,
+            "food_id": self.food_id,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
 
 class Request(db.Model):
     __tablename__ = "requests"
     sender_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
-    receiver_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    receiver_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), primary_key=True, index=True
+    )
     amount = db.Column(db.Integer, nullable=False)
     message = db.Column(db.String, nullable=False)
 
@@ -193,3 +286,305 @@ class Request(db.Model):
             "ampunt": self.amount,
             "message": self.message,
         }
+
+
+class MatchCacheEntry(db.Model):
+    """
+    A receipt string resolved to a restaurant or menu item name, see matchcache.py
+    """
+
+    __tablename__ = "match_cache"
+    scope = db.Column(db.String, primary_key=True)
+    target = db.Column(db.String, primary_key=True)
+    options_hash = db.Column(db.String, primary_key=True)
+    match = db.Column(db.String, nullable=False)
+
+
+class ReceiptJob(db.Model):
+    """
+    A receipt image queued for parsing, see jobs.py
+    """
+
+    __tablename__ = "receipt_jobs"
+    id = db.Column(db.String, primary_key=True)
+    status = db.Column(db.String, nullable=False, index=True)
+    image = db.Column(db.LargeBinary)
+    result = db.Column(db.Text)
+    error = db.Column(db.String)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    repaired = db.Column(db.Boolean)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def serialize(self):
+        data = {"job_id": self.id, "status": self.status}
+        if self.result is not None:
+            data["result"] = json.loads(self.result)
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class ReceiptCacheEntry(db.Model):
+    """
+    A parsed receipt keyed by the hash of its image, see receiptcache.py
+    """
+
+    __tablename__ = "receipt_cache"
+    sha256 = db.Column(db.String, primary_key=True)
+    phash = db.Column(db.String)
+    result = db.Column(db.Text, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    last_used = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+
+
+class ScrapeSource(db.Model):
+    """
+    A restaurant menu page the scraper refreshes, with the validators and
+    content hash of the last version imported, see scraper.py
+    """
+
+    __tablename__ = "scrape_sources"
+    url = db.Column(db.String, primary_key=True)
+    etag = db.Column(db.String)
+    last_modified = db.Column(db.String)
+    content_hash = db.Column(db.String)
+    status = db.Column(db.String)
+    error = db.Column(db.String)
+    item_count = db.Column(db.Integer)
+    checked_at = db.Column(db.DateTime)
+    changed_at = db.Column(db.DateTime)
+
+    def serialize(self):
+        return {
+            "url": self.url,
+            "status": self.status,
+            "error": self.error,
+            "item_count": self.item_count,
+            "checked_at": self.checked_at and self.checked_at.isoformat(),
+            "changed_at": self.changed_at and self.changed_at.isoformat(),
+        }
+
+
+# Columns added to existing tables since the first release, with the DDL used to
+# add them to a database created before they existed
+NEW_COLUMNS = (
+    ("foods", "rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+    ("foods", "review_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_food_reviews", "created_at", "DATETIME"),
+    ("receipt_jobs", "prompt_tokens", "INTEGER"),
+    ("receipt_jobs", "completion_tokens", "INTEGER"),
+    ("receipt_jobs", "latency_ms", "INTEGER"),
+    ("receipt_jobs", "repaired", "BOOLEAN"),
+)
+
+# SQLite full-text index of every food with its restaurant, backing /api/search.
+# Its rowid is the food id, and the triggers keep it in step with both tables.
+SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE food_search USING fts5("
+    "name, category, restaurant_name, restaurant_address, "
+    # Prefix indexes make typing-ahead queries ("chick", "dumpl") one lookup
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4 5 6')",
+    # Hits in the name count most, then the restaurant, category and address
+    "INSERT INTO food_search (food_search, rank) "
+    "VALUES ('rank', 'bm25(10.0, 2.0, 5.0, 1.0)')",
+    "CREATE TRIGGER food_search_insert AFTER INSERT ON foods BEGIN "
+    "INSERT INTO food_search "
+    "(rowid, name, category, restaurant_name, restaurant_address) "
+    "SELECT new.id, new.name, new.category, r.name, r.address "
+    "FROM restaurants r WHERE r.id = new.restaurant_id; END",
+    "CREATE TRIGGER food_search_delete AFTER DELETE ON foods BEGIN "
+    "DELETE FROM food_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER food_search_update "
+    "AFTER UPDATE OF name, category, restaurant_id ON foods BEGIN "
+    "DELETE FROM food_search WHERE rowid = old.id; "
+    "INSERT INTO food_search "
+    "(rowid, name, category, restaurant_name, restaurant_address) "
+    "SELECT new.id, new.name, new.category, r.name, r.address "
+    "FROM restaurants r WHERE r.id = new.restaurant_id; END",
+    "CREATE TRIGGER food_search_restaurant "
+    "AFTER UPDATE OF name, address ON restaurants BEGIN "
+    "UPDATE food_search "
+    "SET restaurant_name = new.name, restaurant_address = new.address "
+    "WHERE rowid IN (SELECT id FROM foods WHERE restaurant_id = new.id); END",
+)
+
+
+def create_search_index(connection):
+    """
+    Creates the food_search index and its triggers on SQLite if they are
+    missing, indexing the foods already in the database
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'food_search'"
+    ).first()
+    if exists:
+        return
+    for statement in SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(
+        "INSERT INTO food_search "
+        "(rowid, name, category, restaurant_name, restaurant_address) "
+        "SELECT f.id, f.name, f.category, r.name, r.address "
+        "FROM foods f JOIN restaurants r ON r.id = f.restaurant_id"
+    )
+
+
+@event.listens_for(Food.__table__, "after_create")
+def create_food_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+
+def merge_duplicate_foods(connection):
+    """
+    Folds foods sharing a restaurant and name into the oldest of them, moving
+    their reviews, favorites and logs over, so the unique menu key can be built
+    """
+    duplicates = (
+        "SELECT f.id AS dup, (SELECT MIN(k.id) FROM foods k "
+        "WHERE k.restaurant_id = f.restaurant_id AND k.name = f.name) AS keep "
+        "FROM foods f"
+    )
+    count = connection.execute(
+        text("SELECT COUNT(*) FROM (%s) WHERE dup != keep" % duplicates)
+    ).scalar()
+    if not count:
+        return
+    connection.execute(
+        text(
+            "CREATE TEMP TABLE food_merges AS SELECT * FROM (%s) WHERE dup != keep"
+            % duplicates
+        )
+    )
+    # A user who reviewed several of the duplicates keeps one review, the
+    # oldest food's if they reviewed it; the rest would break the primary key
+    connection.execute(
+        text(
+            "UPDATE OR IGNORE user_food_reviews SET food_id = "
+            "(SELECT keep FROM food_merges WHERE dup = food_id) "
+            "WHERE food_id IN (SELECT dup FROM food_merges)"
+        )
+    )
+    connection.execute(
+        text(
+            "DELETE FROM user_food_reviews "
+            "WHERE food_id IN (SELECT dup FROM food_merges)"
+        )
+    )
+    for table in (favorites_table, user_food_association_table):
+        connection.execute(
+            text(
+                "INSERT OR IGNORE INTO %s (user_id, food_id) "
+                "SELECT t.user_id, m.keep FROM %s t "
+                "JOIN food_merges m ON m.dup = t.food_id" % (table.name, table.name)
+            )
+        )
+        connection.execute(
+            text(
+                "DELETE FROM %s WHERE food_id IN (SELECT dup FROM food_merges)"
+                % table.name
+            )
+        )
+    connection.execute(
+        text("DELETE FROM foods WHERE id IN (SELECT dup FROM food_merges)")
+    )
+    connection.execute(
+        text(
+            "UPDATE foods SET "
+            "rating_sum = COALESCE((SELECT SUM(rating) FROM user_food_reviews "
+            "WHERE food_id = foods.id), 0), "
+            "review_count = (SELECT COUNT(*) FROM user_food_reviews "
+            "WHERE food_id = foods.id), "
+            "avg_rating = COALESCE((SELECT AVG(rating) FROM user_food_reviews "
+            "WHERE food_id = foods.id), avg_rating) "
+            "WHERE id IN (SELECT keep FROM food_merges)"
+        )
+    )
+    connection.execute(text("DROP TABLE food_merges"))
+    logger.warning("Merged %d duplicate menu items", count)
+
+
+def migrate():
+    """
+    Brings an existing database up to the current models: creates missing
+    tables, adds missing columns, rebuilds the association tables with their
+    primary keys (dropping duplicate rows), merges duplicate menu items and
+    creates any missing indexes, including the food search index. Safe to run
+    repeatedly. Only SQLite databases predate the current schema; others just
+    get any missing tables and indexes.
+    """
+    # Tables added since the database was made, which the steps below alter
+    db.create_all()
+    if db.engine.dialect.name != "sqlite":
+        return
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table, column, definition in NEW_COLUMNS:
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if column not in columns:
+                connection.execute(
+                    text(
+                        "ALTER TABLE %s ADD COLUMN %s %s" % (table, column, definition)
+                    )
+                )
+        # Reviews written before created_at existed sort as if made at migration
+        connection.execute(
+            text(
+                "UPDATE user_food_reviews "
+                "SET created_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' "
+                "WHERE created_at IS NULL"
+            )
+        )
+
+        for table in (favorites_table, user_food_association_table):
+            if inspector.get_pk_constraint(table.name)["constrained_columns"]:
+                continue
+            connection.execute(
+                text("ALTER TABLE %s RENAME TO %s_old" % (table.name, table.name))
+            )
+            table.create(connection)
+            connection.execute(
+                text(
+                    "INSERT OR IGNORE INTO %s (user_id, food_id) "
+                    "SELECT user_id, food_id FROM %s_old "
+                    "WHERE user_id IS NOT NULL AND food_id IS NOT NULL"
+                    % (table.name, table.name)
+                )
+            )
+            connection.execute(text("DROP TABLE %s_old" % table.name))
+
+        merge_duplicate_foods(connection)
+
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+        create_search_index(connection)
+
+
+def backfill_ratings():
+    """
+    Recomputes every food's rating aggregates from its reviews, migrating the
+    database first so the aggregate columns exist
+    """
+    migrate()
+    with db.engine.begin() as connection:
+        connection.execute(text("""
+                UPDATE foods SET
+                    rating_sum = COALESCE(
+                        (SELECT SUM(rating) FROM user_food_reviews
+                         WHERE food_id = foods.id), 0),
+                    review_count = (SELECT COUNT(*) FROM user_food_reviews
+                                    WHERE food_id = foods.id),
+                    avg_rating = COALESCE(
+                        (SELECT AVG(rating) FROM user_food_reviews
+                         WHERE food_id = foods.id), avg_rating)
+                """))
@@ -0,0 +1,151 @@
+"""
+Engine settings for the database. File-backed SQLite gets a connection pool
+and per-connection pragmas (WAL journaling, relaxed fsyncs, a larger page
+cache and memory map, and a busy timeout), so several gunicorn workers can
+write at once and readers don't wait behind writers. Server databases such as
+PostgreSQL get a pool sized from the app config, and read-only views can be
+routed to read replicas with @replica_reads.
+"""
+
+import functools
+import os
+import random
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Set SQLITE_TUNING=0 to connect with SQLite's defaults, e.g. to compare
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") != "0"
+
+# busy_timeout comes first so the others wait out a lock instead of failing
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "10000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # Safe with WAL: a power loss can drop the last commits but never corrupts
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative sizes are in KiB
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "temp_store": "MEMORY",
+}
+
+# Connections kept open per process; one per gunicorn thread plus the
+# background pools is enough. Overridden by the app config keys of the same name.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Server connections older than this many seconds are replaced, before a proxy
+# or the server drops them for being idle
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Space-separated URIs of read replicas of DATABASE_URL
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "").split()
+
+# SQLALCHEMY_BINDS keys of the replica engines are this prefix and a number
+REPLICA_PREFIX = "replica_"
+
+
+def is_sqlite_file(uri):
+    return uri.startswith("sqlite") and uri.split("///", 1)[-1] not in (
+        "",
+        ":memory:",
+        "sqlite://",
+    )
+
+
+def engine_options(uri, config=None):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a database URI, with the pool sized by the
+    DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_TIMEOUT keys of config
+    """
+    config = config or {}
+    pool = {
+        "pool_size": config.get("DB_POOL_SIZE", DB_POOL_SIZE),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", DB_POOL_TIMEOUT),
+    }
+    if not uri.startswith("sqlite"):
+        return dict(
+            pool,
+            pool_pre_ping=True,
+            pool_recycle=config.get("DB_POOL_RECYCLE", DB_POOL_RECYCLE),
+        )
+    if not (SQLITE_TUNING and is_sqlite_file(uri)):
+        return {}
+    return dict(
+        pool,
+        # pysqlite defaults to opening a new connection per checkout, which
+        # would rerun the pragmas on every request
+        poolclass=QueuePool,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+        },
+    )
+
+
+def replica_binds(config):
+    """
+    SQLALCHEMY_BINDS with an engine for each of config's DATABASE_REPLICA_URLS
+    """
+    urls = config.get("DATABASE_REPLICA_URLS", DATABASE_REPLICA_URLS)
+    return {
+        "%s%d" % (REPLICA_PREFIX, i): dict(engine_options(url, config), url=url)
+        for i, url in enumerate(urls)
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute("PRAGMA %s = %s" % (name, value))
+    cursor.close()
+
+
+def configure_engine(engine):
+    """
+    Applies SQLITE_PRAGMAS to every new connection of a SQLite engine
+    """
+    if SQLITE_TUNING and engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+class RoutingSession(Session):
+    """
+    db.session class that runs the SELECTs of a @replica_reads view on that
+    request's replica. Flushes, other statements and locking reads still go to
+    the primary, as does everything outside such a view.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and getattr(clause, "is_select", False)
+            and clause._for_update_arg is None
+            and has_app_context()
+            and "replica_bind" in g
+        ):
+            return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(view):
+    """
+    Marks a view as read-only, so its queries can run on a read replica. One
+    replica is picked per request so the view sees a single snapshot; replicas
+    may lag the primary by the replication delay.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = [
+            key
+            for key in current_app.config["SQLALCHEMY_BINDS"]
+            if key.startswith(REPLICA_PREFIX)
+        ]
+        if replicas:
+            g.replica_bind = random.choice(replicas)
+        return view(*args, **kwargs)
+
+    return wrapper
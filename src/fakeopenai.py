@@ -0,0 +1,45 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+# Canned reply used when no responder is given, shaped like a gpt-4o receipt
+# extraction of the sample receipt in the README
+SAMPLE_RECEIPT = {
+    "store_name": "Pho Time",
+    "items": [
+        {"name": "Chicken Wings (6)", "price": 8.5},
+        {"name": "P12. Chicken Pho", "price": 12.0},
+        {"name": "P2. House Pho 2", "price": 14.95},
+    ],
+    "tax": 2.84,
+    "tips": 6.0,
+    "total": 35.45,
+    "payment_total": 44.29,
+}
+
+
+class FakeOpenAI:
+    """
+    Offline stand-in for the OpenAI client, enabled with OPENAI_FAKE=1. It
+    answers chat.completions.create() with responder(**kwargs), or the sample
+    receipt, after OPENAI_FAKE_DELAY seconds.
+    """
+
+    def __init__(self, responder=None, delay=None):
+        self.responder = responder or (lambda **kwargs: json.dumps(SAMPLE_RECEIPT))
+        if delay is None:
+            delay = float(os.getenv("OPENAI_FAKE_DELAY", "0"))
+        self.delay = delay
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.delay:
+            time.sleep(self.delay)
+        content = self.responder(**kwargs)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+        )
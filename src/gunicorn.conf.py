@@ -0,0 +1,51 @@
+"""
+gunicorn settings for serving munch in production, run from src/ with
+
+    flask --app app init-db
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be tuned through the environment.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Each worker is a process with its own thread pool; threads overlap the time
+# requests spend waiting on SQLite, OpenAI and receipt long-polls
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+
+# Import the app once in the master, so the loaded modules are shared
+# copy-on-write by the forked workers
+preload_app = True
+
+# Receipt polls wait up to 30 seconds, so requests get longer than that
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+# Time a worker is given to finish in-flight requests after SIGTERM
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG")
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def post_fork(server, worker):
+    from app import start_background_workers
+    from db import db
+    from wsgi import app
+
+    # Connections the master opened while preloading can't be shared with
+    # a forked process
+    with app.app_context():
+        db.engine.dispose()
+    # Threads don't survive fork, so each worker starts its own pools
+    start_background_workers(app)
+
+
+def worker_exit(server, worker):
+    from app import stop_background_workers
+
+    stop_background_workers()
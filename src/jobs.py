@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import Float, Integer, cast, func, update
+from db import db, ReceiptJob
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A job left running this long is assumed to belong to a dead worker
+JOB_LEASE = timedelta(seconds=int(os.getenv("RECEIPT_JOB_LEASE", "300")))
+
+
+def format_receipt(result):
+    """
+    Numbers the parsed items and adds the fields the clients expect
+    """
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    for idx, item in enumerate(result.get("items", []), start=1):
+        item["id"] = idx
+
+    result["assigned_friends"] = []
+    return result
+
+
+class ReceiptJobQueue:
+    """
+    Runs receipt parsing on a thread pool so uploads don't hold a request
+    worker for the whole vision round trip. Jobs are persisted in the
+    receipt_jobs table; unfinished ones are picked up again on startup.
+    """
+
+    def __init__(self, parse, max_workers=None, cache=None):
+        self.parse = parse
+        self.cache = cache
+        self.max_workers = max_workers or int(os.getenv("RECEIPT_WORKERS", "4"))
+        self.app = None
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._finished = threading.Condition()
+
+    def init_app(self, app):
+        self.app = app
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="receipt-job"
+        )
+        with app.app_context():
+            stale = datetime.utcnow() - JOB_LEASE
+            jobs = ReceiptJob.query.filter(
+                (ReceiptJob.status == PENDING)
+                | ((ReceiptJob.status == RUNNING) & (ReceiptJob.updated_at < stale))
+            ).all()
+            for job in jobs:
+                self._executor.submit(self._run, job.id, job.status)
+
+    def _ensure_started(self):
+        """
+        Starts the pool on the current app if init_app() wasn't called, e.g.
+        under `flask run` or a test client
+        """
+        with self._start_lock:
+            if self._executor is None:
+                self.init_app(current_app._get_current_object())
+
+    def shutdown(self):
+        """
+        Waits for running jobs and cancels queued ones, which stay pending in
+        the table for the next start
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, image_bytes):
+        """
+        Queues an image for parsing and returns its job. An image already in the
+        cache gets a finished job straight away.
+        """
+        cached = self.cache.lookup(image_bytes) if self.cache else None
+        if cached is not None:
+            job = ReceiptJob(
+                id=uuid.uuid4().hex,
+                status=DONE,
+                result=json.dumps(format_receipt(cached)),
+            )
+            db.session.add(job)
+            db.session.commit()
+            return job
+
+        self._ensure_started()
+        job = ReceiptJob(id=uuid.uuid4().hex, status=PENDING, image=image_bytes)
+        db.session.add(job)
+        db.session.commit()
+        self._executor.submit(self._run, job.id, PENDING)
+        return job
+
+    def _claim(self, job_id, status):
+        """
+        Atomically moves a job to running, so only one worker picks it up
+        """
+        claimed = db.session.execute(
+            update(ReceiptJob)
+            .where(ReceiptJob.id == job_id, ReceiptJob.status == status)
+            .values(status=RUNNING, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, job_id, status):
+        with self.app.app_context():
+            if not self._claim(job_id, status):
+                return
+            job = db.session.get(ReceiptJob, job_id)
+            metrics = {}
+            try:
+                result = self.parse(job.image, metrics)
+                if isinstance(result, str):
+                    result = json.loads(result)
+                if self.cache:
+                    self.cache.store(job.image, result)
+                job.result = json.dumps(format_receipt(result))
+                job.status = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+            job.prompt_tokens = metrics.get("prompt_tokens")
+            job.completion_tokens = metrics.get("completion_tokens")
+            job.latency_ms = metrics.get("latency_ms")
+            job.repaired = metrics.get("repaired")
+            job.image = None
+            db.session.commit()
+        with self._finished:
+            self._finished.notify_all()
+
+    def stats(self):
+        """
+        Token use, latency and repair rate over every parse that reached the API
+        """
+        parsed = ReceiptJob.query.filter(ReceiptJob.latency_ms.isnot(None))
+        count, prompt_tokens, completion_tokens, latency_ms, repaired = (
+            parsed.with_entities(
+                func.count(ReceiptJob.id),
+                func.sum(ReceiptJob.prompt_tokens),
+                func.sum(ReceiptJob.completion_tokens),
+                func.avg(ReceiptJob.latency_ms),
+                # PostgreSQL can't cast a boolean straight to a float
+                func.avg(cast(cast(ReceiptJob.repaired, Integer), Float)),
+            ).one()
+        )
+        return {
+            "parsed": count,
+            "failed": parsed.filter(ReceiptJob.status == FAILED).count(),
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            # PostgreSQL averages come back as Decimal, which json can't encode
+            "avg_latency_ms": float(latency_ms or 0),
+            "repair_rate": float(repaired or 0),
+        }
+
+    def get(self, job_id, wait=0):
+        """
+        Returns a job, waiting up to wait seconds for it to finish. Jobs run by
+        another process are noticed by re-reading the table every half second.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            job = db.session.get(ReceiptJob, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.status in (DONE, FAILED) or remaining <= 0:
+                return job
+            # End the read transaction so the next pass sees the worker's commit
+            db.session.commit()
+            with self._finished:
+                self._finished.wait(min(remaining, 0.5))
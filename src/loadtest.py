@@ -0,0 +1,265 @@
+"""
+Load test under gunicorn. Seeds a throwaway database, then for each worker
+count starts gunicorn.conf.py against a fresh copy of it and reports
+throughput and latency from a pool of keep-alive clients. The reads scenario
+loops over the listing endpoints; the writes scenario is a stress test of
+parallel writers logging and favoriting foods, each request for a (user, food)
+pair no other request touches. Writes runs then check that no request hit
+"database is locked" with SQLITE_TUNING on, and that every food's review_count
+and rating_sum still match its reviews, exiting non-zero otherwise.
+
+    python loadtest.py --workers 1 2 4 --threads 4 --clients 32 --duration 15
+    python loadtest.py --scenario writes --workers 4 --sqlite-tuning 0 1
+"""
+
+import argparse
+import functools
+import itertools
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark import make_app, seed
+from db import db
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = (
+    "/api/restaurants/?limit=50",
+    "/api/food/?limit=50",
+    "/api/food/categories/",
+    "/api/Category%201/foods/?limit=50",
+    "/api/food/1/reviews/?limit=50",
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read(session, base, rng, i):
+    return session.get(base + ENDPOINTS[i % len(ENDPOINTS)])
+
+
+def write(session, base, rng, i, users=1000, foods=1000):
+    """
+    Alternates add_food_to_user and add_favorite; ?include= with no sections
+    keeps the responses small. Request i goes to food i % foods, for the next
+    user once every food has had one, so writers never collide on a key.
+    """
+    food_id = i % foods + 1
+    user_id = i // foods % users + 1
+    if i % 2:
+        path = "/api/users/%d/favorites/?include=" % user_id
+        body = {"food_id": food_id}
+    else:
+        path = "/api/users/%d/food/?include=" % user_id
+        body = {"food_id": food_id, "rating": rng.randint(1, 5), "review": "ok"}
+    return session.post(base + path, json=body)
+
+
+SCENARIOS = {"reads": read, "writes": write}
+
+
+def start_server(database, workers, threads, sqlite_tuning, log):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL="sqlite:///%s" % database,
+        SQLITE_TUNING=str(sqlite_tuning),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_BIND="127.0.0.1:%d" % port,
+        GUNICORN_LOGLEVEL="warning",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+        cwd=SRC,
+        env=env,
+        stderr=log,
+    )
+    base = "http://127.0.0.1:%d" % port
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base + "/api/ready/", timeout=1).status_code == 200:
+                return server, base
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run_clients(base, clients, duration, send):
+    """
+    Each client calls send() on its own keep-alive session until the deadline,
+    numbering requests from one counter so no two clients send the same one.
+    Returns the latencies in ms and the error count.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        session = requests.Session()
+        rng = random.Random(offset)
+        mine = []
+        failed = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = send(session, base, rng, next(counter)).status_code < 300
+            except requests.RequestException:
+                ok = False
+            mine.append((time.perf_counter() - start) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def count_locked(log):
+    """
+    Requests that failed on SQLite's "database is locked", from the server log
+    """
+    log.seek(0)
+    return sum("(sqlite3.OperationalError) database is locked" in line for line in log)
+
+
+def count_drifted_aggregates(database):
+    """
+    Foods whose review_count or rating_sum disagree with their reviews
+    """
+    with sqlite3.connect(database) as connection:
+        return connection.execute("""
+            SELECT COUNT(*) FROM foods WHERE
+                review_count != (SELECT COUNT(*) FROM user_food_reviews
+                                 WHERE food_id = foods.id)
+                OR rating_sum != (SELECT COALESCE(SUM(rating), 0)
+                                  FROM user_food_reviews WHERE food_id = foods.id)
+            """).fetchone()[0]
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the app under gunicorn")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="reads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--foods", type=int, default=20000)
+    parser.add_argument(
+        "--sqlite-tuning",
+        type=int,
+        nargs="+",
+        choices=[0, 1],
+        default=[1],
+        help="Run with SQLITE_TUNING off (0) and/or on (1)",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    seeded = os.path.join(directory, "seed.db")
+    database = os.path.join(directory, "loadtest.db")
+    problems = []
+    try:
+        app = make_app(seeded)
+        with app.app_context():
+            db.create_all()
+            # Writers would collide with seeded reviews on the (user, food) key
+            seed(args.foods, reviews=args.foods if args.scenario == "reads" else 0)
+            db.engine.dispose()
+
+        print(
+            "%8s %8s %8s %10s %8s %8s %8s %8s %8s"
+            % (
+                "tuning",
+                "workers",
+                "threads",
+                "req/s",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "errors",
+                "locked",
+            )
+        )
+        send = SCENARIOS[args.scenario]
+        if send is write:
+            send = functools.partial(write, foods=args.foods)
+        for sqlite_tuning in args.sqlite_tuning:
+            for workers in args.workers:
+                # WAL mode sticks to the file, so every run starts from a copy
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(database + suffix):
+                        os.remove(database + suffix)
+                shutil.copy(seeded, database)
+                log = open(os.path.join(directory, "gunicorn.log"), "w+")
+                server, base = start_server(
+                    database, workers, args.threads, sqlite_tuning, log
+                )
+                try:
+                    latencies, errors = run_clients(
+                        base, args.clients, args.duration, send
+                    )
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    server.wait(timeout=60)
+                with log:
+                    locked = count_locked(log)
+                run = "%d workers with SQLITE_TUNING=%d" % (workers, sqlite_tuning)
+                if send is not read:
+                    # Untuned runs are the baseline that shows the lock errors
+                    if locked and sqlite_tuning:
+                        problems.append("%s: %d locked writes" % (run, locked))
+                    drifted = count_drifted_aggregates(database)
+                    if drifted:
+                        problems.append(
+                            "%s: %d foods' aggregates drifted from their reviews"
+                            % (run, drifted)
+                        )
+                print(
+                    "%8s %8d %8d %10.1f %8.1f %8.1f %8.1f %8d %8d"
+                    % (
+                        "on" if sqlite_tuning else "off",
+                        workers,
+                        args.threads,
+                        len(latencies) / args.duration,
+                        percentile(latencies, 50),
+                        percentile(latencies, 95),
+                        percentile(latencies, 99),
+                        errors,
+                        locked,
+                    )
+                )
+    finally:
+        shutil.rmtree(directory)
+    if problems:
+        sys.exit("\n".join(problems))
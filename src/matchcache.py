@@ -0,0 +1,116 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from convert import normalize
+from db import db, MatchCacheEntry
+
+RESTAURANT_SCOPE = "restaurants"
+
+
+def menu_scope(restaurant_id):
+    return "menu:%d" % restaurant_id
+
+
+def options_hash(options):
+    """
+    Identifies a candidate list regardless of the order it was loaded in
+    """
+    return hashlib.sha1("\n".join(sorted(options)).encode("utf-8")).hexdigest()
+
+
+class MatchCache:
+    """
+    Remembers which candidate a receipt string resolved to. Entries are keyed by
+    scope (the restaurant list or one restaurant's menu), the normalized input
+    and a hash of the candidates, kept in an in-memory LRU in front of the
+    match_cache table so they survive restarts.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def key(self, scope, target, options):
+        return (scope, normalize(target), options_hash(options))
+
+    def get(self, key):
+        """
+        Returns the cached match for a key made by key(), or None on a miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        entry = MatchCacheEntry.query.filter_by(
+            scope=key[0], target=key[1], options_hash=key[2]
+        ).first()
+        if entry is not None:
+            with self._lock:
+                self.db_hits += 1
+            self._remember(key, entry.match)
+            return entry.match
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, match, commit=True):
+        db.session.merge(
+            MatchCacheEntry(
+                scope=key[0], target=key[1], options_hash=key[2], match=match
+            )
+        )
+        if commit:
+            db.session.commit()
+        self._remember(key, match)
+
+    def get_or_compute(self, scope, target, options, compute):
+        """
+        Returns the cached match for target among options, calling compute() and
+        storing its result on a miss. Failed (None) matches are not cached.
+        """
+        key = self.key(scope, target, options)
+        match = self.get(key)
+        if match is None:
+            match = compute()
+            if match is not None:
+                self.put(key, match)
+        return match
+
+    def _remember(self, key, match):
+        with self._lock:
+            self._entries[key] = match
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope):
+        """
+        Drops every entry of a scope, e.g. after a restaurant's menu changes
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == scope]:
+                del self._entries[key]
+        MatchCacheEntry.query.filter_by(scope=scope).delete()
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.db_hits) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "capacity": self.capacity,
+            }
+
+
+match_cache = MatchCache()
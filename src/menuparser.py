@@ -0,0 +1,88 @@
+"""
+Extracts the restaurant and menu items from an ithacatogo.com menu page. Kept
+apart from scraper.py so lxml is only loaded once a page actually changed.
+"""
+
+import logging
+import re
+import lxml.html
+from lxml.cssselect import CSSSelector
+from lxml.etree import ParserError
+
+# Compiled once to XPath and evaluated by lxml in C
+RESTAURANT_NAME = CSSSelector(".media-heading")
+RESTAURANT_ADDRESS = CSSSelector(".media-body .restaurant_menu_info-addresss")
+MENU_ITEM = CSSSelector(
+    ".order_restaurant--restaurant_headings.panel.panel-default "
+    ".order_restaurant--menu_item.clearfix"
+)
+ITEM_NAME = CSSSelector(".order_restaurant--menu_item_name")
+ITEM_PRICE = CSSSelector(".menu_item_price")
+PRICE_PATTERN = re.compile(r"\$(\d+\.\d+)")
+
+logger = logging.getLogger(__name__)
+
+
+def parse_price(text):
+    match = PRICE_PATTERN.search(text)
+    if match:
+        return float(match.group(1))
+    try:
+        return float(text.replace("$", "").strip())
+    except ValueError:
+        return 0.0
+
+
+def first_text(selector, element):
+    """
+    Stripped text of the first element matching selector, or None
+    """
+    matches = selector(element)
+    return matches[0].text_content().strip() if matches else None
+
+
+def parse_menu(html):
+    """
+    Extracts the restaurant and its menu items from a menu page, or returns None
+    if the page isn't one
+    """
+    try:
+        root = lxml.html.document_fromstring(html)
+    except ParserError:
+        logger.warning("Empty page")
+        return None
+
+    restaurant_name = first_text(RESTAURANT_NAME, root)
+    if restaurant_name is None:
+        logger.warning("Could not find restaurant info section")
+        return None
+    restaurant_address = (
+        first_text(RESTAURANT_ADDRESS, root) or "Unknown Address, Ithaca, NY"
+    )
+
+    menu_data = []
+    for item in MENU_ITEM(root):
+        item_name = first_text(ITEM_NAME, item)
+        if item_name is None:
+            continue
+        menu_data.append(
+            {
+                "name": item_name,
+                "price": parse_price(first_text(ITEM_PRICE, item) or ""),
+                "category": "tbd",
+                "description": "tbd",
+                "image_url": "fakeurl",
+                "avg_rating": 0,
+            }
+        )
+
+    logger.info(
+        "Parsed %s (%s): %d menu items",
+        restaurant_name,
+        restaurant_address,
+        len(menu_data),
+    )
+    return {
+        "restaurant": {"name": restaurant_name, "address": restaurant_address},
+        "menu_items": menu_data,
+    }
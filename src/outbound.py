@@ -0,0 +1,231 @@
+"""
+All outbound network I/O goes through here: pooled keep-alive clients for
+plain HTTP and OpenAI, per-host concurrency limits, timeouts, retries with
+exponential backoff and jitter, and a per-host circuit breaker.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv("OUTBOUND_TIMEOUT", "10"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+MAX_PER_HOST = int(os.getenv("OUTBOUND_MAX_PER_HOST", "8"))
+BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "8"))
+BREAKER_THRESHOLD = int(os.getenv("OUTBOUND_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.getenv("OUTBOUND_BREAKER_RESET", "30"))
+
+OPENAI_HOST = "api.openai.com"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a host whose circuit breaker is open
+    """
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__("HTTP %d" % response.status_code)
+        self.response = response
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures and rejects calls until
+    reset_timeout has passed, then lets a single trial call through
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+_hosts_lock = threading.Lock()
+_semaphores = {}
+_breakers = {}
+
+
+def host_limits(host):
+    """
+    The concurrency semaphore and circuit breaker shared by all calls to a host
+    """
+    with _hosts_lock:
+        if host not in _semaphores:
+            _semaphores[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+            _breakers[host] = CircuitBreaker()
+        return _semaphores[host], _breakers[host]
+
+
+def is_retryable(exc):
+    if isinstance(exc, RetryableStatus):
+        return True
+    # requests is imported on first use, and can't have raised before that
+    requests = sys.modules.get("requests")
+    if requests and isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    # openai's transient errors, matched by name so openai stays optional
+    return type(exc).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "RateLimitError",
+        "InternalServerError",
+    )
+
+
+def backoff(attempt):
+    """
+    Full-jitter exponential backoff
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def call(host, fn, *args, retries=MAX_RETRIES, **kwargs):
+    """
+    Calls fn under host's concurrency limit and circuit breaker, retrying
+    transient failures with backoff
+    """
+    semaphore, breaker = host_limits(host)
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit open for %s" % host)
+        try:
+            with semaphore:
+                result = fn(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                # The host answered, it just rejected this call
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt == retries:
+                if isinstance(e, RetryableStatus):
+                    return e.response
+                raise
+            time.sleep(backoff(attempt))
+        else:
+            breaker.record_success()
+            return result
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Shared requests session, keeping up to MAX_PER_HOST connections alive per host
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_PER_HOST)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def http_get(url, timeout=HTTP_TIMEOUT, **kwargs):
+    """
+    GET through the shared session. Retryable statuses (429, 5xx) are retried,
+    and the last response is returned if they persist.
+    """
+
+    def attempt():
+        response = get_session().get(url, timeout=timeout, **kwargs)
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(response)
+        return response
+
+    return call(urlparse(url).hostname, attempt)
+
+
+_openai_client = None
+
+
+def openai_http_client():
+    """
+    httpx client sized to the per-host limit, or None to let openai build its
+    own default pool
+    """
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=MAX_PER_HOST, max_keepalive_connections=MAX_PER_HOST
+        ),
+        timeout=OPENAI_TIMEOUT,
+    )
+
+
+def get_openai_client():
+    """
+    Shared OpenAI client with a pooled keep-alive connection, or the offline
+    fake when OPENAI_FAKE is set. Retries are left to call().
+    """
+    global _openai_client
+    with _session_lock:
+        if _openai_client is None:
+            if os.getenv("OPENAI_FAKE"):
+                from fakeopenai import FakeOpenAI
+
+                _openai_client = FakeOpenAI()
+            else:
+                from openai import OpenAI
+
+                _openai_client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    timeout=OPENAI_TIMEOUT,
+                    max_retries=0,
+                    http_client=openai_http_client(),
+                )
+        return _openai_client
+
+
+def chat_completion(**kwargs):
+    """
+    client.chat.completions.create() through the OpenAI host's limits
+    """
+    return call(OPENAI_HOST, get_openai_client().chat.completions.create, **kwargs)
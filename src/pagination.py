@@ -0,0 +1,146 @@
+import base64
+import json
+import orjson
+from flask import Response, request, stream_with_context
+from sqlalchemy import literal, tuple_
+
+MAX_LIMIT = 500
+STREAM_BATCH_SIZE = 500
+
+
+def get_page_args(parse_after=int):
+    """
+    Reads the ?limit= and ?after= keyset pagination arguments from the request.
+    limit is None when the client asks for the whole collection.
+    Raises ValueError on malformed arguments.
+    """
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1 or limit > MAX_LIMIT:
+            raise ValueError("limit must be between 1 and %d" % MAX_LIMIT)
+    if after is not None:
+        after = parse_after(after)
+    return limit, after
+
+
+def encode_cursor(values):
+    """
+    Packs the sort key of the last row of a page into an opaque cursor
+    """
+    data = json.dumps(values, default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Unpacks a cursor made by encode_cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def wants_stream():
+    """
+    Whether the client asked for the collection as a streamed JSON array
+    """
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def paginate(query, column, limit=None, after=None):
+    """
+    Returns one page of query ordered by column, starting after the cursor, and
+    the cursor of the next page (None on the last page)
+    """
+    query = query.order_by(column)
+    if after is not None:
+        query = query.filter(column > after)
+    if limit is None:
+        return query.all(), None
+    # Fetch one extra row to know whether another page exists
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, getattr(items[-1], column.key)
+
+
+def paginate_desc(query, columns, key, limit=None, after=None):
+    """
+    Keyset pagination over a descending multi-column sort. columns must end in
+    a unique key, key maps a row to its values for those columns, and after is
+    the decoded cursor of the previous page.
+    """
+    query = query.order_by(*(column.desc() for column in columns))
+    if after is not None:
+        values = (literal(v, column.type) for column, v in zip(columns, after))
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+    if limit is None:
+        return query.all(), None
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(list(key(items[-1])))
+
+
+def iter_pages(query, column, batch_size=STREAM_BATCH_SIZE):
+    """
+    Walks the whole query in keyset-ordered pages so only one page is held in
+    memory at a time
+    """
+    after = None
+    while True:
+        page, after = paginate(query, column, batch_size, after)
+        yield page
+        if after is None:
+            return
+
+
+def iter_batches(query, column, batch_size=STREAM_BATCH_SIZE):
+    """
+    Yields every row of the query, one page at a time
+    """
+    for page in iter_pages(query, column, batch_size):
+        yield from page
+
+
+def stream_collection(key, query, column, serialize):
+    """
+    Streams every row of query as a JSON array, wrapped in {key: [...]} unless
+    key is None, without building the full list in memory
+    """
+    return stream_json(key, iter_batches(query, column), serialize)
+
+
+def stream_json(key, items, serialize):
+    """
+    Streams the items of an iterator as a JSON array, wrapped in {key: [...]}
+    unless key is None
+    """
+
+    def generate():
+        yield b"[" if key is None else b"{%s: [" % orjson.dumps(key)
+        first = True
+        for item in items:
+            yield (b"" if first else b", ") + orjson.dumps(serialize(item))
+            first = False
+        yield b"]" if key is None else b"]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def cursor_headers(next_cursor):
+    """
+    Exposes the next-page cursor as a header, which also covers endpoints that
+    return a bare JSON array
+    """
+    if next_cursor is None:
+        return {}
+    return {"X-Next-Cursor": str(next_cursor)}
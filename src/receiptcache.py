@@ -0,0 +1,114 @@
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+from sqlalchemy import func
+from db import db, ReceiptCacheEntry
+
+# Total size of cached results, least recently used entries are evicted first
+RECEIPT_CACHE_BYTES = int(os.getenv("RECEIPT_CACHE_BYTES", str(50 * 1024 * 1024)))
+
+# Re-shots whose perceptual hashes differ in at most this many bits count as the
+# same receipt. Off unless set, since different receipts from the same till can
+# look alike at thumbnail size.
+RECEIPT_PHASH_DISTANCE = os.getenv("RECEIPT_PHASH_DISTANCE")
+
+HASH_SIZE = 16
+
+
+def perceptual_hash(image_bytes):
+    """
+    256-bit difference hash: compares neighbouring pixels of a tiny grayscale
+    thumbnail, so it survives re-encoding, resizing and small exposure changes
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+    pixels = list(
+        image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).getdata()
+    )
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return "%064x" % bits
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ReceiptCache:
+    """
+    Content-addressed store of parsed receipts, so duplicate uploads of the same
+    photo are answered without another vision call
+    """
+
+    def __init__(self, max_bytes=RECEIPT_CACHE_BYTES, phash_distance=None):
+        if phash_distance is None and RECEIPT_PHASH_DISTANCE is not None:
+            phash_distance = int(RECEIPT_PHASH_DISTANCE)
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance
+
+    def _phash(self, image_bytes):
+        if self.phash_distance is None:
+            return None
+        try:
+            return perceptual_hash(image_bytes)
+        except Exception:
+            return None
+
+    def lookup(self, image_bytes):
+        """
+        Returns the cached parse of an image, or None
+        """
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        entry = db.session.get(ReceiptCacheEntry, sha256)
+        if entry is None:
+            phash = self._phash(image_bytes)
+            if phash is not None:
+                candidates = ReceiptCacheEntry.query.filter(
+                    ReceiptCacheEntry.phash.isnot(None)
+                )
+                entry = next(
+                    (
+                        candidate
+                        for candidate in candidates
+                        if hamming(candidate.phash, phash) <= self.phash_distance
+                    ),
+                    None,
+                )
+        if entry is None:
+            return None
+        entry.last_used = datetime.utcnow()
+        db.session.commit()
+        return json.loads(entry.result)
+
+    def store(self, image_bytes, result):
+        """
+        Caches the parse of an image, evicting the least recently used results
+        once the cache is over its size budget
+        """
+        data = json.dumps(result)
+        db.session.merge(
+            ReceiptCacheEntry(
+                sha256=hashlib.sha256(image_bytes).hexdigest(),
+                phash=self._phash(image_bytes),
+                result=data,
+                size=len(data),
+                last_used=datetime.utcnow(),
+            )
+        )
+        db.session.flush()
+        total = db.session.query(func.sum(ReceiptCacheEntry.size)).scalar() or 0
+        if total > self.max_bytes:
+            for entry in ReceiptCacheEntry.query.order_by(ReceiptCacheEntry.last_used):
+                if total <= self.max_bytes:
+                    break
+                total -= entry.size
+                db.session.delete(entry)
+        db.session.commit()
@@ -0,0 +1,223 @@
+"""
+Caches the JSON of rarely changing GET endpoints (restaurants and their
+menus) with strong ETags, so repeat requests skip the database and clients
+holding the current version get a bodiless 304. Entries live in a per-process
+LRU, or in Redis when RESPONSE_CACHE_REDIS_URL is set so every worker shares
+them and sees invalidations at once.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import make_response, request, Response
+
+# Seconds an entry is served for; also bounds how stale another worker's
+# in-process cache can be after a write. 0 turns caching off.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")
+
+REDIS_PREFIX = "munch:response:"
+
+RESTAURANTS_SCOPE = "restaurants"
+
+logger = logging.getLogger(__name__)
+
+
+def restaurant_scope(restaurant_id):
+    return "restaurant:%d" % restaurant_id
+
+
+class MemoryBackend:
+    """
+    LRU of entries that expire ttl seconds after being stored
+    """
+
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+
+    def generation(self, scope):
+        with self._lock:
+            return self._generations.get(scope, 0)
+
+    def bump(self, scope):
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Entries and scope generations kept in Redis. Errors are logged and
+    treated as misses, so the API keeps working without Redis.
+    """
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.errors = redis.RedisError
+
+    def generation(self, scope):
+        try:
+            return int(self.client.get(REDIS_PREFIX + "gen:" + scope) or 0)
+        except self.errors as e:
+            logger.warning("Response cache unavailable: %s", e)
+            return None
+
+    def bump(self, scope):
+        try:
+            self.client.incr(REDIS_PREFIX + "gen:" + scope)
+        except self.errors as e:
+            logger.error("Could not invalidate %s: %s", scope, e)
+
+    def get(self, key):
+        try:
+            raw = self.client.get(REDIS_PREFIX + key)
+        except self.errors as e:
+            logger.warning("Response cache unavailable: %s", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, entry):
+        try:
+            self.client.set(REDIS_PREFIX + key, json.dumps(entry), ex=int(self.ttl))
+        except self.errors as e:
+            logger.warning("Response cache unavailable: %s", e)
+
+    def size(self):
+        return None
+
+
+class ResponseCache:
+    """
+    Views wrapped with cached() are keyed by their full path and query string
+    and the generation of the scope they read. Write paths call invalidate()
+    after committing, which bumps the generation so older entries are never
+    served again; a response built while a write raced past is stored under
+    the old generation and likewise never served.
+    """
+
+    def __init__(
+        self,
+        ttl=RESPONSE_CACHE_TTL,
+        capacity=RESPONSE_CACHE_SIZE,
+        redis_url=RESPONSE_CACHE_REDIS_URL,
+    ):
+        self.ttl = ttl
+        if redis_url:
+            self.backend = RedisBackend(redis_url, ttl)
+        else:
+            self.backend = MemoryBackend(capacity, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def cached(self, scope):
+        """
+        Caches a view's 200 responses under scope, a string or a function of
+        the view's URL arguments returning one. Streamed responses are passed
+        through.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.ttl <= 0:
+                    return view(*args, **kwargs)
+                name = scope(**kwargs) if callable(scope) else scope
+                generation = self.backend.generation(name)
+                key = "%s@%s:%s" % (name, generation, request.full_path)
+                entry = self.backend.get(key) if generation is not None else None
+                with self._lock:
+                    if entry is None:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+
+                if entry is not None:
+                    response = Response(entry["body"], headers=entry["headers"])
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data(as_text=True)
+                    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+                    # Clients must revalidate, since writes invalidate entries
+                    response.cache_control.no_cache = True
+                    if generation is not None:
+                        self.backend.set(
+                            key,
+                            {"body": body, "headers": list(response.headers.items())},
+                        )
+
+                response = response.make_conditional(request)
+                if response.status_code == 304:
+                    with self._lock:
+                        self.not_modified += 1
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, *scopes):
+        for scope in scopes:
+            self.backend.bump(scope)
+
+    def invalidate_restaurant(self, restaurant_id):
+        """
+        Drops a restaurant's cached responses, and the listings embedding it
+        """
+        self.invalidate(restaurant_scope(restaurant_id), RESTAURANTS_SCOPE)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": (
+                    "redis" if isinstance(self.backend, RedisBackend) else "memory"
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": self.backend.size(),
+                "capacity": getattr(self.backend, "capacity", None),
+                "ttl": self.ttl,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,76 @@
+from datetime import datetime
+from sqlalchemy.orm import contains_eager
+from db import Food, User, UserFoodReview
+from pagination import STREAM_BATCH_SIZE, decode_cursor, paginate_desc
+
+# Feed orderings: the sort column and how to read it back out of a cursor.
+# Ties are broken by (food_id, user_id), the review's primary key.
+FEED_SORTS = {
+    "recent": (UserFoodReview.created_at, datetime.fromisoformat),
+    "rating": (UserFoodReview.rating, int),
+}
+
+
+def feed_query(food_id=None, category=None):
+    """
+    Reviews joined to their foods and reviewers, so the whole feed comes back
+    from a single query
+    """
+    query = (
+        UserFoodReview.query.join(Food, UserFoodReview.food_id == Food.id)
+        .join(User, UserFoodReview.user_id == User.id)
+        .options(contains_eager(UserFoodReview.user))
+    )
+    if food_id is not None:
+        query = query.filter(UserFoodReview.food_id == food_id)
+    if category is not None:
+        query = query.filter(Food.category == category)
+    return query
+
+
+def parse_feed_cursor(sort):
+    """
+    Returns a parser for ?after= cursors of the feed in the given order
+    """
+    parse_value = FEED_SORTS[sort][1]
+
+    def parse(cursor):
+        values = decode_cursor(cursor)
+        if len(values) != 3:
+            raise ValueError("Invalid cursor")
+        try:
+            return [parse_value(values[0]), int(values[1]), int(values[2])]
+        except TypeError as e:
+            # Well-formed JSON of the wrong types, e.g. null or a list
+            raise ValueError("Invalid cursor") from e
+
+    return parse
+
+
+def review_feed(query, sort, limit=None, after=None):
+    """
+    One page of a review feed, newest or best rated first, and the cursor of
+    the next page
+    """
+    column = FEED_SORTS[sort][0]
+    return paginate_desc(
+        query,
+        [column, UserFoodReview.food_id, UserFoodReview.user_id],
+        lambda review: (getattr(review, column.key), review.food_id, review.user_id),
+        limit,
+        after,
+    )
+
+
+def iter_review_feed(query, sort, batch_size=STREAM_BATCH_SIZE):
+    """
+    Walks a whole review feed in keyset batches
+    """
+    parse = parse_feed_cursor(sort)
+    after = None
+    while True:
+        batch, cursor = review_feed(query, sort, batch_size, after)
+        yield from batch
+        if cursor is None:
+            return
+        after = parse(cursor)
@@ -0,0 +1,347 @@
+"""
+Scrapes restaurant menus from ithacatogo.com pages. Pages are fetched
+concurrently under a shared rate limit, with conditional requests and a hash
+of the page body so menus that haven't changed are skipped without parsing.
+Scrapes run in the background; the last state of every page is kept in the
+scrape_sources table.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from catalog import category_catalog
+from db import db, Food, Restaurant, ScrapeSource
+from matchcache import RESTAURANT_SCOPE, match_cache, menu_scope
+from outbound import http_get
+from responsecache import response_cache
+
+DEFAULT_URLS = os.getenv(
+    "SCRAPE_URLS",
+    "https://www.ithacatogo.com/order/restaurant/pho-time-vietnamese-menu/45",
+).split()
+
+# Hosts whose pages POST /api/scrape/ may ask for. The CLI can scrape any URL,
+# including file:// fixtures.
+SCRAPE_ALLOWED_HOSTS = set(
+    os.getenv("SCRAPE_ALLOWED_HOSTS", "www.ithacatogo.com ithacatogo.com").split()
+)
+
+# Pages fetched at once, and the most requests started per second across them
+SCRAPER_WORKERS = int(os.getenv("SCRAPER_WORKERS", "4"))
+SCRAPER_RATE = float(os.getenv("SCRAPER_RATE", "2"))
+
+# Rows per multi-row INSERT, keeping each statement under SQLite's default limit
+# of 999 bound parameters
+INSERT_BATCH_SIZE = 100
+
+# INSERT constructs with ON CONFLICT support, by dialect name
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+logger = logging.getLogger(__name__)
+
+UPDATED = "updated"
+NOT_MODIFIED = "not_modified"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+class RateLimiter:
+    """
+    Spaces out calls to wait() so at most rate of them return per second
+    """
+
+    def __init__(self, rate=SCRAPER_RATE):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def is_allowed_url(url):
+    """
+    Whether url is an http(s) page on one of SCRAPE_ALLOWED_HOSTS
+    """
+    parsed = urlparse(url)
+    return (
+        parsed.scheme in ("http", "https") and parsed.hostname in SCRAPE_ALLOWED_HOSTS
+    )
+
+
+def fetch_page(url, etag=None, last_modified=None):
+    """
+    Fetches a menu page, sending the validators of the last version seen.
+    Returns (status_code, text, etag, last_modified); status 304 means the page
+    hasn't changed. file:// URLs are read from disk, so saved pages can be
+    scraped as fixtures.
+    """
+    if url.startswith("file://"):
+        with open(url2pathname(unquote(urlparse(url).path)), encoding="utf-8") as f:
+            return 200, f.read(), None, None
+
+    headers = dict(HEADERS)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = http_get(url, headers=headers)
+    return (
+        response.status_code,
+        response.text,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def insert_into_database(data):
+    """
+    Imports a scraped menu in a handful of statements: one read of the names
+    already on the menu, multi-row INSERT ... ON CONFLICT DO NOTHING batches for
+    new items, and one executemany UPDATE for changed prices
+    """
+    if not data:
+        logger.warning("No data to insert into database")
+        return False
+
+    try:
+        restaurant = Restaurant.query.filter_by(name=data["restaurant"]["name"]).first()
+        created = restaurant is None
+        if created:
+            restaurant = Restaurant(
+                name=data["restaurant"]["name"], address=data["restaurant"]["address"]
+            )
+            db.session.add(restaurant)
+            db.session.flush()
+
+        # Items listed under several headings are imported once, at their last price
+        items = {item["name"]: item for item in data["menu_items"]}
+        prices = dict(
+            db.session.query(Food.name, Food.price).filter(
+                Food.restaurant_id == restaurant.id
+            )
+        )
+
+        new_rows = [
+            {
+                "name": item["name"],
+                "price": item["price"],
+                "category": item["category"],
+                "image_url": item["image_url"],
+                "avg_rating": item["avg_rating"],
+                "rating_sum": 0,
+                "review_count": 0,
+                "restaurant_id": restaurant.id,
+            }
+            for name, item in items.items()
+            if name not in prices
+        ]
+        insert = UPSERT_INSERTS[db.engine.dialect.name]
+        for i in range(0, len(new_rows), INSERT_BATCH_SIZE):
+            db.session.execute(
+                insert(Food.__table__)
+                .values(new_rows[i : i + INSERT_BATCH_SIZE])
+                .on_conflict_do_nothing(index_elements=["restaurant_id", "name"])
+            )
+
+        price_changes = [
+            {"b_name": name, "b_price": item["price"]}
+            for name, item in items.items()
+            if name in prices and prices[name] != item["price"]
+        ]
+        if price_changes:
+            foods = Food.__table__
+            db.session.execute(
+                foods.update()
+                .where(
+                    foods.c.restaurant_id == restaurant.id,
+                    foods.c.name == bindparam("b_name"),
+                )
+                .values(price=bindparam("b_price")),
+                price_changes,
+            )
+
+        db.session.commit()
+        if new_rows:
+            category_catalog.invalidate()
+            match_cache.invalidate(menu_scope(restaurant.id))
+        if created:
+            match_cache.invalidate(RESTAURANT_SCOPE)
+        if new_rows or price_changes or created:
+            response_cache.invalidate_restaurant(restaurant.id)
+        logger.info(
+            "Imported %s: %d new items, %d price changes",
+            data["restaurant"]["name"],
+            len(new_rows),
+            len(price_changes),
+        )
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Database error: %s", e)
+        return False
+
+
+class Scraper:
+    """
+    Refreshes menu pages on a background thread. Each run fetches its pages
+    concurrently; pages answering 304, or whose body hashes the same as the
+    last import, are skipped, and the rest are parsed and imported one at a
+    time on the run's thread.
+    """
+
+    def __init__(self, fetch=fetch_page, max_workers=None, rate=None):
+        self.fetch = fetch
+        self.max_workers = max_workers or SCRAPER_WORKERS
+        self.limiter = RateLimiter(SCRAPER_RATE if rate is None else rate)
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        # The run waiting to start, and the pages it will refresh
+        self._queued = None
+        self._queued_all = False
+        self._queued_urls = []
+
+    def init_app(self, app):
+        self.app = app
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="scrape-job"
+        )
+
+    def shutdown(self):
+        """
+        Waits for a run in progress and cancels a queued one
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, urls=None):
+        """
+        Queues a refresh of urls (by default every known page) and returns the
+        pending run. While a run waits to start, later requests are merged into
+        it, so one run is in progress and at most one queued behind it.
+        """
+        with self._lock:
+            if self._executor is None:
+                # init_app() wasn't called, e.g. under `flask run`
+                self.init_app(current_app._get_current_object())
+            if urls is None:
+                self._queued_all = True
+            else:
+                self._queued_urls.extend(urls)
+            if self._queued is None:
+                self._queued = self._executor.submit(self._run_queued)
+            return self._queued
+
+    def _run_queued(self):
+        with self._lock:
+            run_all, urls = self._queued_all, self._queued_urls
+            self._queued = None
+            self._queued_all = False
+            self._queued_urls = []
+        with self.app.app_context():
+            return self.run(self.known_urls() + urls if run_all else urls)
+
+    def known_urls(self):
+        """
+        Every page scraped before, and the SCRAPE_URLS defaults. Needs an app
+        context.
+        """
+        known = [source.url for source in ScrapeSource.query]
+        return known + [url for url in DEFAULT_URLS if url not in known]
+
+    def _check(self, url, etag, last_modified, previous_hash):
+        """
+        Fetches one page and parses it if it changed. Runs on the fetch pool, so
+        it must not touch the database.
+        """
+        self.limiter.wait()
+        status_code, text, etag, last_modified = self.fetch(url, etag, last_modified)
+        if status_code == 304:
+            return NOT_MODIFIED, None, None, None, None
+        if status_code != 200:
+            raise ValueError("HTTP %d" % status_code)
+        digest = content_hash(text)
+        if digest == previous_hash:
+            return UNCHANGED, None, etag, last_modified, digest
+        from menuparser import parse_menu
+
+        data = parse_menu(text)
+        if data is None:
+            raise ValueError("Not a menu page")
+        return UPDATED, data, etag, last_modified, digest
+
+    def run(self, urls=None):
+        """
+        Refreshes urls (by default every known page) and returns a count of
+        pages by outcome. Needs an app context.
+        """
+        if urls is None:
+            urls = self.known_urls()
+        urls = list(dict.fromkeys(urls))
+
+        sources = {}
+        for url in urls:
+            sources[url] = db.session.get(ScrapeSource, url) or ScrapeSource(url=url)
+
+        summary = {UPDATED: 0, NOT_MODIFIED: 0, UNCHANGED: 0, FAILED: 0}
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="scrape-fetch"
+        ) as pool:
+            futures = {
+                pool.submit(
+                    self._check,
+                    url,
+                    source.etag,
+                    source.last_modified,
+                    source.content_hash,
+                ): source
+                for url, source in sources.items()
+            }
+            for future in as_completed(futures):
+                source = futures[future]
+                source.checked_at = datetime.utcnow()
+                source.error = None
+                try:
+                    status, data, etag, last_modified, digest = future.result()
+                    if status == UPDATED and not insert_into_database(data):
+                        raise ValueError("Import failed")
+                except Exception as e:
+                    logger.warning("Scraping %s failed: %s", source.url, e)
+                    status = FAILED
+                    source.error = str(e)
+                source.status = status
+                if status == UPDATED:
+                    source.item_count = len(data["menu_items"])
+                    source.changed_at = source.checked_at
+                if status in (UPDATED, UNCHANGED):
+                    source.etag = etag
+                    source.last_modified = last_modified
+                    source.content_hash = digest
+                db.session.add(source)
+                db.session.commit()
+                summary[status] += 1
+        return summary
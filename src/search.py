@@ -0,0 +1,154 @@
+"""
+Food search for /api/search. Every word of the query must prefix-match a
+word of the food's name, category, restaurant name or address. On SQLite the
+food_search FTS5 index answers it: foods whose names match come first, then
+the other matches, each ranked by BM25. Other databases fall back to a LIKE
+scan ordered by name.
+"""
+
+import contextlib
+import os
+import re
+import time
+from sqlalchemy import column, or_, select, table, text
+from sqlalchemy.exc import OperationalError
+from db import db, Food, Restaurant
+from fastjson import food_rows
+
+SEARCH_LIMIT = 20
+
+# Shorter terms match whole words only. A one-letter prefix would match a
+# large share of the catalog, with no prefix index to answer it.
+SEARCH_MIN_PREFIX = int(os.getenv("SEARCH_MIN_PREFIX", "2"))
+
+# BM25 costs a couple of microseconds per match, so a query matching much of a
+# large catalog takes seconds to rank. Ranking stops after this long, and the
+# query is rejected as too broad; 0 lets it run to the end.
+SEARCH_BUDGET_MS = float(os.getenv("SEARCH_BUDGET_MS", "250"))
+
+# SQLite VM steps between checks of the budget
+BUDGET_CHECK_STEPS = 1000
+
+TERM = re.compile(r"\w+")
+
+food_search = table("food_search", column("rowid"), column("rank"))
+
+
+class SearchTooBroad(Exception):
+    """
+    Raised when ranking a query's matches runs past SEARCH_BUDGET_MS
+    """
+
+
+def search_terms(query):
+    return TERM.findall(query.lower())
+
+
+def match_expression(terms):
+    """
+    FTS5 query requiring every term as a word prefix, or as a whole word if
+    it's shorter than SEARCH_MIN_PREFIX. Terms are quoted so words like AND or
+    NEAR aren't read as operators.
+    """
+    return " ".join(
+        ('"%s"*' if len(term) >= SEARCH_MIN_PREFIX else '"%s"') % term for term in terms
+    )
+
+
+@contextlib.contextmanager
+def time_budget(connection, budget_ms):
+    """
+    Interrupts statements run on connection once budget_ms have passed,
+    raising SearchTooBroad
+    """
+    if not budget_ms:
+        yield
+        return
+    deadline = time.monotonic() + budget_ms / 1000
+    dbapi_connection = connection.connection.dbapi_connection
+    dbapi_connection.set_progress_handler(
+        lambda: time.monotonic() > deadline, BUDGET_CHECK_STEPS
+    )
+    try:
+        yield
+    except OperationalError as e:
+        if "interrupted" in str(e.orig):
+            raise SearchTooBroad("Search took over %g ms" % budget_ms) from e
+        raise
+    finally:
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def ranked_matches(match, limit):
+    """
+    The best limit foods for an FTS5 query, by the BM25 weights configured on
+    food_search
+    """
+    # FTS5 ranks every match but keeps only the best limit rows while sorting,
+    # and they're joined to foods after
+    best = (
+        select(food_search.c.rowid, food_search.c.rank)
+        .where(text("food_search MATCH :match"))
+        .order_by(food_search.c.rank)
+        .limit(limit)
+        .subquery()
+    )
+    return (
+        food_rows()
+        .join(best, best.c.rowid == Food.id)
+        .order_by(best.c.rank)
+        .params(match=match)
+        .all()
+    )
+
+
+def fts_search(terms, limit=SEARCH_LIMIT, budget_ms=None):
+    """
+    Foods whose names match, best first, followed by the best of the other
+    matches if there are fewer than limit. Most queries name a dish, so
+    usually only the name matches, a fraction of all of them, are ranked.
+    budget_ms defaults to SEARCH_BUDGET_MS.
+    """
+    if budget_ms is None:
+        budget_ms = SEARCH_BUDGET_MS
+    match = match_expression(terms)
+    names = "{name} : (%s)" % match
+    connection = db.session.connection(bind_arguments={"clause": food_rows().statement})
+    with time_budget(connection, budget_ms):
+        rows = ranked_matches(names, limit)
+        if len(rows) < limit:
+            rows += ranked_matches("(%s) NOT %s" % (match, names), limit - len(rows))
+    return rows
+
+
+def like_search(terms, limit=SEARCH_LIMIT):
+    """
+    Scans every food for rows containing each term anywhere in the searched
+    columns
+    """
+    columns = (Food.name, Food.category, Restaurant.name, Restaurant.address)
+    conditions = [
+        or_(
+            *(
+                c.ilike("%%%s%%" % term.replace("_", "\\_"), escape="\\")
+                for c in columns
+            )
+        )
+        for term in terms
+    ]
+    return (
+        food_rows().filter(*conditions).order_by(Food.name, Food.id).limit(limit).all()
+    )
+
+
+def search_foods(query, limit=SEARCH_LIMIT):
+    """
+    Returns food_rows() rows matching query, best first. Raises SearchTooBroad
+    if ranking them runs over budget.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if db.engine.dialect.name == "sqlite":
+        return fts_search(terms, limit)
+    return like_search(terms, limit)
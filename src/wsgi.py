@@ -0,0 +1,8 @@
+"""
+WSGI entry point for gunicorn, see gunicorn.conf.py. The background pools are
+started in each worker after it forks, not here in the preloading master.
+"""
+
+from app import create_app
+
+app = create_app()
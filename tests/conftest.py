@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from collections import OrderedDict
+
+import pytest
+from app import create_app
+from catalog import category_catalog
+from db import db
+from matchcache import match_cache
+from responsecache import response_cache
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    App on a fresh SQLite database, with the process-wide caches emptied and
+    response caching off so no test sees another's rows
+    """
+    monkeypatch.setattr(response_cache, "ttl", 0)
+    category_catalog.invalidate()
+    monkeypatch.setattr(match_cache, "_entries", OrderedDict())
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///%s" % (tmp_path / "munch.db"),
+        }
+    )
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
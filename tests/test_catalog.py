@@ -0,0 +1,39 @@
+from catalog import CategoryCatalog, category_catalog
+from db import db, Food, Restaurant
+
+
+def add_food(category):
+    db.session.add(
+        Food(
+            name="%s Pho" % category,
+            price=10,
+            category=category,
+            image_url="",
+            avg_rating=0,
+            restaurant_id=1,
+        )
+    )
+    db.session.commit()
+
+
+def test_invalidate_reaches_other_catalogs(app):
+    db.session.add(Restaurant(name="Pho Time", address="1 College Ave", image_url=""))
+    add_food("Soup")
+    other_worker = CategoryCatalog()
+    assert other_worker.get() == {"Soup": 1}
+    add_food("Noodles")
+    category_catalog.invalidate()
+    assert other_worker.get() == {"Noodles": 1, "Soup": 1}
+
+
+def test_counts_expire_after_ttl(app, monkeypatch):
+    db.session.add(Restaurant(name="Pho Time", address="1 College Ave", image_url=""))
+    add_food("Soup")
+    catalog = CategoryCatalog(ttl=60)
+    assert catalog.get() == {"Soup": 1}
+    # Written by another worker, whose invalidation this one never sees
+    add_food("Noodles")
+    assert catalog.get() == {"Soup": 1}
+    now = catalog._entry[1]
+    monkeypatch.setattr("catalog.time.monotonic", lambda: now + 1)
+    assert catalog.get() == {"Noodles": 1, "Soup": 1}
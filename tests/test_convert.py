@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"restaurant": "Pho Time"},
+        {"item": "Chicken Pho"},
+        {"restaurant": "Pho Time", "item": 3},
+        {"restaurant": ["Pho Time"], "item": "Chicken Pho"},
+    ],
+)
+def test_convert_rejects_missing_or_non_string_fields(client, body):
+    response = client.get("/api/convert/", data=json.dumps(body))
+    assert response.status_code == 400
+    assert json.loads(response.data) == {"error": "Invalid input"}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"restaurant": "Pho Time"},
+        {"restaurant": "Pho Time", "items": "Chicken Pho"},
+        {"restaurant": "Pho Time", "items": [1]},
+        {"restaurant": "Pho Time", "items": ["Chicken Pho", None]},
+        {"restaurant": 1, "items": ["Chicken Pho"]},
+    ],
+)
+def test_convert_batch_rejects_non_string_items(client, body):
+    response = client.post("/api/convert/batch", data=json.dumps(body))
+    assert response.status_code == 400
+    assert json.loads(response.data) == {"error": "Invalid input"}
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from db import db, Food, Restaurant, User, UserFoodReview
+
+
+@pytest.fixture
+def catalog(app):
+    db.session.add(Restaurant(name="Pho Time", address="409 Eddy St", image_url=""))
+    db.session.add(
+        Food(
+            name="Chicken Pho",
+            price=12,
+            category="Pho",
+            image_url="",
+            avg_rating=0,
+            restaurant_id=1,
+        )
+    )
+    for i in (1, 2):
+        db.session.add(
+            User(
+                username="user%d" % i,
+                password="password",
+                email="user%d@example.com" % i,
+                phone=6070000000 + i,
+                venmo="user%d" % i,
+                profile_image="",
+            )
+        )
+        db.session.add(UserFoodReview(user_id=i, food_id=1, rating=i, review="ok"))
+    db.session.commit()
+
+
+@pytest.mark.parametrize(
+    "url, paginated",
+    [
+        ("/api/users/?limit=1", True),
+        ("/api/food/1/reviews/?limit=1", True),
+        ("/api/food/1/reviews/?limit=1&sort=rating", True),
+        ("/api/food/Pho/reviews/?limit=1", True),
+        ("/api/restaurants/1/menu/", False),
+        ("/api/restaurants/?limit=1", False),
+        ("/api/food/?limit=1", False),
+    ],
+)
+def test_listings_are_json(client, catalog, url, paginated):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert response.json == json.loads(response.data)
+    assert ("X-Next-Cursor" in response.headers) == paginated
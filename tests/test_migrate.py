@@ -0,0 +1,126 @@
+from sqlalchemy import inspect, text
+from app import create_app
+from db import db, migrate
+
+# The schema before any migration, with a review, a favorite logged twice and
+# a duplicated menu item
+PRE_MIGRATION_SCHEMA = (
+    "CREATE TABLE restaurants (id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+    "address VARCHAR NOT NULL, image_url VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, "
+    "password VARCHAR NOT NULL, email VARCHAR NOT NULL, phone INTEGER NOT NULL, "
+    "venmo VARCHAR NOT NULL, profile_image VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE foods (id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+    "price FLOAT NOT NULL, category VARCHAR NOT NULL, image_url VARCHAR NOT NULL, "
+    "avg_rating INTEGER NOT NULL, restaurant_id INTEGER NOT NULL, "
+    "PRIMARY KEY (id), FOREIGN KEY(restaurant_id) REFERENCES restaurants (id))",
+    "CREATE TABLE requests (sender_id INTEGER NOT NULL, "
+    "receiver_id INTEGER NOT NULL, amount INTEGER NOT NULL, "
+    "message VARCHAR NOT NULL, PRIMARY KEY (sender_id, receiver_id))",
+    "CREATE TABLE favorites (user_id INTEGER, food_id INTEGER)",
+    "CREATE TABLE user_food (user_id INTEGER, food_id INTEGER)",
+    "CREATE TABLE user_food_reviews (user_id INTEGER NOT NULL, "
+    "food_id INTEGER NOT NULL, rating INTEGER NOT NULL, review VARCHAR NOT NULL, "
+    "PRIMARY KEY (user_id, food_id))",
+)
+
+RESTAURANT = (
+    "INSERT INTO restaurants (id, name, address, image_url) "
+    "VALUES (1, 'Pho Time', '1 College Ave', '')"
+)
+USERS = (
+    "INSERT INTO users (id, username, password, email, phone, venmo, profile_image) "
+    "VALUES (1, 'a', '', '', 0, '', ''), (2, 'b', '', '', 0, '', '')"
+)
+
+
+def insert_food(connection, food_id, name):
+    connection.execute(
+        text(
+            "INSERT INTO foods (id, name, price, category, image_url, avg_rating, "
+            "restaurant_id) VALUES (:id, :name, 10, 'Soup', '', 0, 1)"
+        ),
+        {"id": food_id, "name": name},
+    )
+
+
+def insert_review(connection, user_id, food_id, rating):
+    connection.execute(
+        text(
+            "INSERT INTO user_food_reviews "
+            "(user_id, food_id, rating, review, created_at) "
+            "VALUES (:user_id, :food_id, :rating, '', CURRENT_TIMESTAMP)"
+        ),
+        {"user_id": user_id, "food_id": food_id, "rating": rating},
+    )
+
+
+def test_migrate_merges_duplicates_reviewed_by_the_same_user(app):
+    with db.engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_foods_restaurant_id_name"))
+        connection.execute(text(RESTAURANT))
+        connection.execute(text(USERS))
+        insert_food(connection, 1, "Pho")
+        insert_food(connection, 2, "Pho")
+        insert_food(connection, 3, "Pho")
+        insert_food(connection, 4, "Banh Mi")
+        insert_review(connection, 1, 1, 5)
+        insert_review(connection, 1, 2, 1)
+        insert_review(connection, 2, 2, 4)
+        insert_review(connection, 2, 3, 2)
+
+    migrate()
+
+    with db.engine.connect() as connection:
+        assert connection.execute(
+            text("SELECT id FROM foods ORDER BY id")
+        ).scalars().all() == [1, 4]
+        assert connection.execute(
+            text(
+                "SELECT user_id, food_id, rating FROM user_food_reviews "
+                "ORDER BY user_id"
+            )
+        ).all()[0] == (1, 1, 5)
+        reviews = connection.execute(
+            text("SELECT COUNT(*), SUM(rating) FROM user_food_reviews")
+        ).one()
+        aggregates = connection.execute(
+            text("SELECT review_count, rating_sum FROM foods WHERE id = 1")
+        ).one()
+        assert tuple(aggregates) == tuple(reviews)
+        assert reviews[0] == 2
+
+
+def test_migrate_and_backfill_a_pre_migration_database(tmp_path):
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///%s" % (tmp_path / "old.db")}
+    )
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for statement in PRE_MIGRATION_SCHEMA:
+                connection.execute(text(statement))
+            connection.execute(text(RESTAURANT))
+            connection.execute(text(USERS))
+            insert_food(connection, 1, "Pho")
+            insert_food(connection, 2, "Pho")
+            connection.execute(
+                text(
+                    "INSERT INTO user_food_reviews VALUES (1, 2, 4, 'Good'), "
+                    "(2, 1, 2, 'Cold')"
+                )
+            )
+            connection.execute(text("INSERT INTO favorites VALUES (1, 1), (1, 1)"))
+
+        runner = app.test_cli_runner()
+        for command in ("migrate", "backfill-ratings", "migrate"):
+            result = runner.invoke(args=[command])
+            assert result.exit_code == 0, result.output
+
+        tables = set(inspect(db.engine).get_table_names())
+        assert {"receipt_jobs", "receipt_cache", "scrape_sources"} <= tables
+        with db.engine.connect() as connection:
+            assert connection.execute(
+                text("SELECT id, review_count, rating_sum FROM foods")
+            ).all() == [(1, 2, 6)]
+            assert connection.execute(text("SELECT * FROM favorites")).all() == [(1, 1)]
+        db.engine.dispose()
@@ -0,0 +1,151 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+import outbound
+from outbound import CircuitBreaker, CircuitOpenError, call, http_get
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers each GET with the next of the server's scripted statuses, the last
+    one repeating, after the server's delay
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            status = server.statuses.pop(0) if len(server.statuses) > 1 else None
+            status = status or server.statuses[0]
+        time.sleep(server.delay)
+        body = b"ok" if status == 200 else b"unavailable"
+        try:
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.statuses = [200]
+    server.delay = 0
+    server.url = "http://127.0.0.1:%d/menu" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_hosts(monkeypatch):
+    """
+    New breakers and semaphores per test, and no backoff sleeps
+    """
+    monkeypatch.setattr(outbound, "_breakers", {})
+    monkeypatch.setattr(outbound, "_semaphores", {})
+    monkeypatch.setattr(outbound, "backoff", lambda attempt: 0)
+
+
+def use_breaker(breaker):
+    outbound.host_limits("127.0.0.1")
+    outbound._breakers["127.0.0.1"] = breaker
+    return breaker
+
+
+def test_http_get_retries_503(stub):
+    stub.statuses = [503, 503, 200]
+    response = http_get(stub.url)
+    assert response.status_code == 200
+    assert stub.requests == 3
+
+
+def test_http_get_returns_last_response_once_retries_are_spent(stub):
+    stub.statuses = [503]
+    response = http_get(stub.url)
+    assert response.status_code == 503
+    assert stub.requests == outbound.MAX_RETRIES + 1
+
+
+def test_http_get_does_not_retry_other_errors(stub):
+    stub.statuses = [404, 200]
+    assert http_get(stub.url).status_code == 404
+    assert stub.requests == 1
+
+
+def test_http_get_retries_timeouts(stub):
+    stub.delay = 0.5
+    with pytest.raises(requests.Timeout):
+        http_get(stub.url, timeout=0.1)
+    assert stub.requests == outbound.MAX_RETRIES + 1
+
+
+def test_breaker_opens_after_threshold_failures(stub):
+    use_breaker(CircuitBreaker(threshold=2, reset_timeout=60))
+    stub.statuses = [503]
+    with pytest.raises(CircuitOpenError):
+        http_get(stub.url)
+    assert stub.requests == 2
+    # Rejected without reaching the host
+    with pytest.raises(CircuitOpenError):
+        http_get(stub.url)
+    assert stub.requests == 2
+
+
+def test_breaker_lets_a_trial_through_after_reset_timeout(stub):
+    breaker = use_breaker(CircuitBreaker(threshold=2, reset_timeout=0.2))
+    stub.statuses = [503]
+    with pytest.raises(CircuitOpenError):
+        http_get(stub.url)
+    stub.statuses = [200]
+    time.sleep(0.3)
+    assert http_get(stub.url).status_code == 200
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_breaker(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(outbound.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 31
+    assert breaker.allow()
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 62
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_call_counts_rejections_as_successes():
+    breaker = use_breaker(CircuitBreaker(threshold=1))
+
+    def reject():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call("127.0.0.1", reject)
+    assert breaker.allow()
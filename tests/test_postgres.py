@@ -0,0 +1,109 @@
+"""
+Runs the dialect-specific paths against PostgreSQL: the schema, the
+scraper's ON CONFLICT upsert, the atomic rating update and the receipt stats
+aggregates. Set TEST_POSTGRES_URL to a scratch database, whose tables are
+dropped, or install testing.postgresql to start a throwaway server.
+"""
+
+import json
+import os
+import uuid
+
+import pytest
+from sqlalchemy import inspect
+import app as munch
+from db import db, Food, ReceiptJob, Restaurant
+from jobs import DONE, FAILED
+from scraper import insert_into_database
+
+
+@pytest.fixture(scope="module")
+def postgres_url():
+    url = os.getenv("TEST_POSTGRES_URL")
+    if url:
+        yield url
+        return
+    testing_postgresql = pytest.importorskip(
+        "testing.postgresql", reason="needs TEST_POSTGRES_URL or testing.postgresql"
+    )
+    with testing_postgresql.Postgresql() as postgresql:
+        yield postgresql.url()
+
+
+@pytest.fixture
+def pg_app(postgres_url, monkeypatch):
+    monkeypatch.setattr(munch.response_cache, "ttl", 0)
+    app = munch.create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": postgres_url})
+    with app.app_context():
+        db.drop_all()
+        result = app.test_cli_runner().invoke(args=["init-db"])
+        assert result.exit_code == 0, result.output
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def menu(prices):
+    return {
+        "restaurant": {"name": "Pho Time", "address": "1 College Ave"},
+        "menu_items": [
+            {
+                "name": name,
+                "price": price,
+                "category": "Soup",
+                "image_url": "",
+                "avg_rating": 0,
+            }
+            for name, price in prices.items()
+        ],
+    }
+
+
+def test_init_db_creates_every_table(pg_app):
+    assert set(db.metadata.tables) <= set(inspect(db.engine).get_table_names())
+
+
+def test_scraper_upserts_menus(pg_app):
+    assert insert_into_database(menu({"Pho": 12.5, "Banh Mi": 9}))
+    assert insert_into_database(menu({"Pho": 13.5, "Banh Mi": 9, "Spring Rolls": 6}))
+    restaurant = Restaurant.query.filter_by(name="Pho Time").one()
+    prices = dict(
+        db.session.query(Food.name, Food.price).filter_by(restaurant_id=restaurant.id)
+    )
+    assert prices == {"Pho": 13.5, "Banh Mi": 9, "Spring Rolls": 6}
+
+
+def test_add_rating_updates_aggregates(pg_app):
+    assert insert_into_database(menu({"Pho": 12.5}))
+    food = Food.query.filter_by(name="Pho").one()
+    for rating in (5, 2):
+        Food.add_rating(food.id, rating)
+    db.session.commit()
+    db.session.refresh(food)
+    assert (food.review_count, food.rating_sum, food.avg_rating) == (2, 7, 3.5)
+
+
+def test_receipt_stats(pg_app):
+    for status, repaired in ((DONE, False), (DONE, True), (FAILED, False)):
+        db.session.add(
+            ReceiptJob(
+                id=uuid.uuid4().hex,
+                status=status,
+                prompt_tokens=100,
+                completion_tokens=20,
+                latency_ms=300,
+                repaired=repaired,
+            )
+        )
+    db.session.commit()
+    response = pg_app.test_client().get("/api/receipts/stats/")
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "parsed": 3,
+        "failed": 1,
+        "prompt_tokens": 300,
+        "completion_tokens": 60,
+        "avg_latency_ms": 300.0,
+        "repair_rate": pytest.approx(1 / 3),
+    }
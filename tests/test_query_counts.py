@@ -0,0 +1,107 @@
+"""
+The listings load their rows with a fixed number of statements, however many
+rows there are
+"""
+
+import contextlib
+
+from sqlalchemy import event
+from db import db, Food, Restaurant, User, favorites_table
+
+LISTINGS = (
+    "/api/food/",
+    "/api/Category%200/foods/",
+    "/api/users/1/favorites/",
+    "/api/restaurants/",
+)
+
+
+RESTAURANTS = 5
+CATEGORIES = 3
+
+
+def seed_user_and_restaurants():
+    db.session.execute(
+        User.__table__.insert(),
+        {
+            "id": 1,
+            "username": "user",
+            "password": "password",
+            "email": "user@example.com",
+            "phone": 6070000000,
+            "venmo": "user",
+            "profile_image": "",
+        },
+    )
+    db.session.execute(
+        Restaurant.__table__.insert(),
+        [
+            {
+                "id": i + 1,
+                "name": "Restaurant %d" % i,
+                "address": "%d College Ave" % i,
+                "image_url": "",
+            }
+            for i in range(RESTAURANTS)
+        ],
+    )
+    db.session.commit()
+
+
+def add_foods(first, count):
+    """
+    Adds foods first + 1 to first + count, spread over every restaurant and
+    category and all favorited by user 1
+    """
+    ids = range(first + 1, first + count + 1)
+    db.session.execute(
+        Food.__table__.insert(),
+        [
+            {
+                "id": i,
+                "name": "Food %d" % i,
+                "price": float(i),
+                "category": "Category %d" % (i % CATEGORIES),
+                "image_url": "",
+                "avg_rating": 0.0,
+                "restaurant_id": i % RESTAURANTS + 1,
+            }
+            for i in ids
+        ],
+    )
+    db.session.execute(
+        favorites_table.insert(), [{"user_id": 1, "food_id": i} for i in ids]
+    )
+    db.session.commit()
+
+
+@contextlib.contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def statements_per_listing(client):
+    counts = {}
+    for url in LISTINGS:
+        with count_statements() as statements:
+            response = client.get(url)
+        assert response.status_code == 200, url
+        counts[url] = len(statements)
+    return counts
+
+
+def test_listing_statement_counts_do_not_grow_with_rows(client):
+    seed_user_and_restaurants()
+    add_foods(0, 10)
+    small = statements_per_listing(client)
+    add_foods(10, 290)
+    assert statements_per_listing(client) == small
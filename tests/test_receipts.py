@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+import pytest
+import app as munch
+import outbound
+from db import db, ReceiptJob
+from fakeopenai import SAMPLE_RECEIPT, FakeOpenAI
+from jobs import DONE, PENDING
+
+RECEIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src", "receipt.png")
+
+
+@pytest.fixture
+def pending_job(app):
+    db.session.add(ReceiptJob(id="pending", status=PENDING))
+    db.session.commit()
+    return "pending"
+
+
+@pytest.mark.parametrize("wait", ["nan", "inf", "-inf", "soon"])
+def test_receipt_job_rejects_invalid_wait(client, pending_job, wait):
+    response = client.get("/api/receipts/%s/?wait=%s" % (pending_job, wait))
+    assert response.status_code == 400
+    assert json.loads(response.data) == {"error": "Invalid wait"}
+
+
+def test_receipt_job_negative_wait_returns_at_once(client, pending_job):
+    start = time.monotonic()
+    response = client.get("/api/receipts/%s/?wait=-5" % pending_job)
+    assert time.monotonic() - start < 0.5
+    assert json.loads(response.data)["status"] == PENDING
+
+
+@pytest.fixture
+def fake_openai(app, monkeypatch):
+    """
+    Receipt parsing through FakeOpenAI, on workers not yet started
+    """
+    fake = FakeOpenAI()
+    monkeypatch.setattr(outbound, "_openai_client", fake)
+    monkeypatch.setattr(munch.receipt_jobs, "app", None)
+    monkeypatch.setattr(munch.receipt_jobs, "_executor", None)
+    yield fake
+    munch.receipt_jobs.shutdown()
+
+
+def upload(client):
+    with open(RECEIPT, "rb") as f:
+        response = client.post("/api/receipts/", data={"image": (f, "receipt.png")})
+    assert response.status_code == 202
+    return response.json["job_id"]
+
+
+def test_receipt_job_parses_offline_and_caches_duplicates(app, client, fake_openai):
+    munch.receipt_jobs.init_app(app)
+    job_id = upload(client)
+    job = json.loads(client.get("/api/receipts/%s/?wait=5" % job_id).data)
+    assert job["status"] == DONE
+    assert job["result"]["store_name"] == SAMPLE_RECEIPT["store_name"]
+    assert [item["id"] for item in job["result"]["items"]] == [1, 2, 3]
+    assert len(fake_openai.calls) == 1
+
+    duplicate = upload(client)
+    assert duplicate != job_id
+    job = json.loads(client.get("/api/receipts/%s/" % duplicate).data)
+    assert job["status"] == DONE
+    assert job["result"]["store_name"] == SAMPLE_RECEIPT["store_name"]
+    assert len(fake_openai.calls) == 1
+
+
+def test_receipt_upload_starts_workers_on_first_use(client, fake_openai):
+    job_id = upload(client)
+    job = json.loads(client.get("/api/receipts/%s/?wait=5" % job_id).data)
+    assert job["status"] == DONE
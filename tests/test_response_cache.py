@@ -0,0 +1,122 @@
+"""
+Cached restaurant views with caching on: conditional requests get a 304, and
+every write path touching the restaurant changes the next response
+"""
+
+import json
+
+import pytest
+from db import db, Food, Restaurant, User
+from responsecache import MemoryBackend, response_cache
+from scraper import insert_into_database
+
+VIEWS = ("/api/restaurants/", "/api/restaurants/1/", "/api/restaurants/1/menu/")
+
+
+@pytest.fixture
+def cached(app, monkeypatch):
+    monkeypatch.setattr(response_cache, "ttl", 300)
+    monkeypatch.setattr(response_cache, "backend", MemoryBackend(64, 300))
+    db.session.add(Restaurant(name="Pho Time", address="409 Eddy St", image_url=""))
+    db.session.add(
+        User(
+            username="user",
+            password="password",
+            email="user@example.com",
+            phone=6070000000,
+            venmo="user",
+            profile_image="",
+        )
+    )
+    db.session.add(
+        Food(
+            name="Chicken Pho",
+            price=12,
+            category="Pho",
+            image_url="",
+            avg_rating=0,
+            restaurant_id=1,
+        )
+    )
+    db.session.commit()
+
+
+def snapshot(client):
+    """
+    Body and ETag of every cached view
+    """
+    responses = {url: client.get(url) for url in VIEWS}
+    for url, response in responses.items():
+        assert response.status_code == 200, url
+        assert response.headers["ETag"], url
+    return {url: (r.data, r.headers["ETag"]) for url, r in responses.items()}
+
+
+def test_repeat_request_with_etag_gets_304(client, cached):
+    for url, (body, etag) in snapshot(client).items():
+        hits = response_cache.hits
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304, url
+        assert response.data == b""
+        assert response_cache.hits == hits + 1
+        response = client.get(url)
+        assert (response.data, response.headers["ETag"]) == (body, etag)
+
+
+def scrape_new_item():
+    assert insert_into_database(
+        {
+            "restaurant": {"name": "Pho Time", "address": "409 Eddy St"},
+            "menu_items": [
+                {
+                    "name": "Spring Rolls",
+                    "price": 6,
+                    "category": "Appetizers",
+                    "image_url": "",
+                    "avg_rating": 0,
+                }
+            ],
+        }
+    )
+
+
+WRITES = {
+    "create_food": lambda client: client.post(
+        "/api/restaurants/1/food/",
+        data=json.dumps(
+            {
+                "name": "Banh Mi",
+                "price": 9,
+                "category": "Sandwiches",
+                "image_url": "",
+                "initial_rating": 0,
+            }
+        ),
+    ),
+    "update_food_image": lambda client: client.post(
+        "/api/food/1/image/", data=json.dumps({"img_url": "https://example.com/p.png"})
+    ),
+    "update_food_category": lambda client: client.post(
+        "/api/food/1/category/", data=json.dumps({"category": "Soup"})
+    ),
+    "delete_food_by_id": lambda client: client.delete("/api/food/1/"),
+    "review": lambda client: client.post(
+        "/api/users/1/food/?include=",
+        data=json.dumps({"food_id": 1, "rating": 5, "review": "Great"}),
+    ),
+    "insert_into_database": lambda client: scrape_new_item(),
+}
+
+
+@pytest.mark.parametrize("write", WRITES)
+def test_writes_invalidate_cached_views(client, cached, write):
+    before = snapshot(client)
+    response = WRITES[write](client)
+    if response is not None:
+        assert response.status_code < 300, response.data
+    after = snapshot(client)
+    for url in VIEWS:
+        assert after[url][0] != before[url][0], url
+        assert after[url][1] != before[url][1], url
+        response = client.get(url, headers={"If-None-Match": before[url][1]})
+        assert response.status_code == 200, url
@@ -0,0 +1,18 @@
+import json
+
+import pytest
+from pagination import encode_cursor
+
+
+@pytest.mark.parametrize(
+    "values",
+    [[None, 1, 1], ["2024-01-01T00:00:00", [], 1], [{}, 1, 1], [1, 2], "x"],
+)
+@pytest.mark.parametrize("sort", ["recent", "rating"])
+def test_feed_rejects_mistyped_cursors(client, sort, values):
+    response = client.get(
+        "/api/food/1/reviews/",
+        query_string={"limit": 1, "sort": sort, "after": encode_cursor(values)},
+    )
+    assert response.status_code == 400
+    assert json.loads(response.data) == {"error": "Invalid pagination parameters"}
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+
+import pytest
+import app as munch
+from db import db, Food, Restaurant, ScrapeSource
+from scraper import (
+    FAILED,
+    NOT_MODIFIED,
+    UNCHANGED,
+    UPDATED,
+    RateLimiter,
+    Scraper,
+)
+
+MENU_PAGE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "src", "pho_time_menu.html"
+)
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    calls = []
+    monkeypatch.setattr(munch.scraper, "submit", calls.append)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "file:///etc/passwd",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://localhost:5000/api/food/",
+        "https://ithacatogo.com.example.com/menu",
+        "ftp://www.ithacatogo.com/menu",
+    ],
+)
+def test_scrape_rejects_urls_off_the_allowed_hosts(client, submitted, url):
+    response = client.post(
+        "/api/scrape/",
+        data=json.dumps(
+            {"urls": ["https://www.ithacatogo.com/order/restaurant/a/1", url]}
+        ),
+    )
+    assert response.status_code == 400
+    assert submitted == []
+
+
+def test_scrape_queues_allowed_urls(client, submitted):
+    url = "https://www.ithacatogo.com/order/restaurant/pho-time-vietnamese-menu/45"
+    response = client.post("/api/scrape/", data=json.dumps({"urls": [url]}))
+    assert response.status_code == 202
+    assert submitted == [[url]]
+
+
+def test_scrape_without_urls_queues_every_known_page(client, submitted):
+    response = client.post("/api/scrape/")
+    assert response.status_code == 202
+    assert submitted == [None]
+
+
+def test_submit_merges_requests_into_the_queued_run(app):
+    started = threading.Event()
+    release = threading.Event()
+    fetched = []
+
+    def fetch(url, etag=None, last_modified=None):
+        fetched.append(url)
+        if url == "first":
+            started.set()
+            release.wait(5)
+        return 304, None, None, None
+
+    scraper = Scraper(fetch=fetch, rate=0)
+    scraper.init_app(app)
+    try:
+        first = scraper.submit(["first"])
+        assert started.wait(5)
+        second = scraper.submit(["second"])
+        third = scraper.submit(["third", "second"])
+        assert third is second and second is not first
+        release.set()
+        assert first.result(5) == {
+            UPDATED: 0,
+            NOT_MODIFIED: 1,
+            UNCHANGED: 0,
+            FAILED: 0,
+        }
+        assert second.result(5)[NOT_MODIFIED] == 2
+    finally:
+        release.set()
+        scraper.shutdown()
+    assert sorted(fetched) == ["first", "second", "third"]
+
+
+def outcome(**counts):
+    return {UPDATED: 0, NOT_MODIFIED: 0, UNCHANGED: 0, FAILED: 0, **counts}
+
+
+def test_scrapes_saved_menu_page(app, tmp_path):
+    url = "file://" + MENU_PAGE
+    scraper = Scraper(rate=0)
+    assert scraper.run([url]) == outcome(updated=1)
+
+    restaurant = Restaurant.query.one()
+    assert (restaurant.name, restaurant.address) == (
+        "Pho Time",
+        "409 Eddy St, Ithaca, NY 14850",
+    )
+    prices = dict(db.session.query(Food.name, Food.price))
+    assert len(prices) == 12
+    assert prices["Chicken Wings (6)"] == 8.5
+    source = db.session.get(ScrapeSource, url)
+    assert (source.status, source.item_count) == (UPDATED, 12)
+
+    assert scraper.run([url]) == outcome(unchanged=1)
+    assert db.session.get(ScrapeSource, url).status == UNCHANGED
+
+    # The same restaurant saved under another URL with a new price updates
+    # its menu instead of adding a second Pho Time
+    with open(MENU_PAGE, encoding="utf-8") as f:
+        page = f.read()
+    assert page.count("8.50") >= 1
+    changed = tmp_path / "menu.html"
+    changed.write_text(page.replace("8.50", "9.25"), encoding="utf-8")
+    assert scraper.run(["file://%s" % changed]) == outcome(updated=1)
+    assert Restaurant.query.count() == 1
+    assert Food.query.count() == 12
+    prices = dict(db.session.query(Food.name, Food.price))
+    assert prices["Chicken Wings (6)"] == 9.25
+
+
+def test_scrape_starts_its_pool_on_first_use(client, monkeypatch):
+    url = "https://www.ithacatogo.com/order/restaurant/pho-time-vietnamese-menu/45"
+    monkeypatch.setattr(munch.scraper, "app", None)
+    monkeypatch.setattr(munch.scraper, "_executor", None)
+    monkeypatch.setattr(munch.scraper, "limiter", RateLimiter(0))
+    monkeypatch.setattr(
+        munch.scraper, "fetch", lambda url, *validators: (304, None, None, None)
+    )
+    try:
+        response = client.post("/api/scrape/", data=json.dumps({"urls": [url]}))
+        assert response.status_code == 202
+    finally:
+        munch.scraper.shutdown()
+    sources = json.loads(client.get("/api/scrape/").data)["sources"]
+    assert [(s["url"], s["status"]) for s in sources] == [(url, NOT_MODIFIED)]
@@ -0,0 +1,63 @@
+import json
+
+from db import db, Food, Restaurant
+from search import match_expression
+
+
+def add_restaurant(name, foods):
+    restaurant = Restaurant(name=name, address="1 College Ave", image_url="")
+    db.session.add(restaurant)
+    db.session.flush()
+    db.session.execute(
+        Food.__table__.insert(),
+        [
+            {
+                "name": food,
+                "price": 10,
+                "category": "Soup",
+                "image_url": "",
+                "avg_rating": 0,
+                "restaurant_id": restaurant.id,
+            }
+            for food in foods
+        ],
+    )
+    db.session.commit()
+
+
+def search(client, query):
+    response = client.get("/api/search", query_string={"q": query, "limit": 3})
+    assert response.status_code == 200
+    return [food["name"] for food in json.loads(response.data)["food_items"]]
+
+
+def test_search_ranks_every_match(client):
+    # Thousands of weaker matches indexed before the best one
+    add_restaurant("Pho Palace", ["Dish %d" % i for i in range(3000)])
+    add_restaurant("Noodle Bar", ["Pho"])
+    assert search(client, "pho")[0] == "Pho"
+
+
+def test_search_matches_short_terms_as_whole_words(client):
+    add_restaurant("Plan B", ["Pad Thai", "Pho"])
+    assert match_expression(["b", "pho"]) == '"b" "pho"*'
+    assert search(client, "p") == []
+    assert search(client, "b pho") == ["Pho"]
+
+
+def test_search_names_first(client):
+    add_restaurant("Pho Palace", ["Spring Rolls", "Banh Mi"])
+    add_restaurant("Noodle Bar", ["Chicken Pho"])
+    assert search(client, "pho")[0] == "Chicken Pho"
+    assert sorted(search(client, "pho")[1:]) == ["Banh Mi", "Spring Rolls"]
+
+
+def test_search_over_budget_is_rejected(client, monkeypatch):
+    add_restaurant("Pho Palace", ["Dish %d" % i for i in range(3000)])
+    monkeypatch.setattr("search.SEARCH_BUDGET_MS", 1e-6)
+    response = client.get("/api/search", query_string={"q": "dish"})
+    assert response.status_code == 400
+    assert json.loads(response.data) == {"error": "Search too broad, add more words!"}
+    # The connection takes queries again once the budget is lifted
+    monkeypatch.setattr("search.SEARCH_BUDGET_MS", 0)
+    assert len(search(client, "dish")) == 3